@@ -1,9 +1,16 @@
 import os
 import math
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
 import numpy as np
 import matplotlib.pyplot as plt
+import waveforms
 
 
     #=============================================================#
@@ -28,6 +35,122 @@ def digital_conv_func (array, max_dac, data_type):
 
 
 
+def digital_conv_into (array, out, max_dac):
+    """This does the same as digital_conv_func, but in place: no new arrays are created.
+    The float array is used as scratch space and the result is written into out.
+    TAKES: A float array with values between [-1 and 1] (it gets overwritten)
+           The output array, of the DAC data type (uint16 or uint8) and the same length
+           The range of the DAC
+    RETURNS: The out array"""
+    
+    half_dac = max_dac // 2
+    
+    np.add(array, 1.0, out=array)
+    np.multiply(array, half_dac, out=array)
+    np.rint(array, out=array)
+    np.clip(array, 0, max_dac, out=array)
+    np.copyto(out, array, casting='unsafe')
+    
+    return out
+
+
+
+class Quantizer():
+    """
+    Converts large arrays to the DAC format (as digital_conv_func) chunk by chunk over a pool of threads
+    (the numpy functions release the GIL, so the chunks really run in parallel).
+    Every thread keeps its own float scratch buffer of one chunk between calls, so besides the output
+    only workers * chunk floats are ever allocated, whatever the length of the array.
+    """
+
+    def __init__ (self, max_dac = 65535, data_type = np.uint16, workers = None, chunk = 2**20):
+        """
+        TAKES:
+            max_dac - the range of the DAC (65535 for 16-bit, 255 for 8-bit P9082 mode)
+            data_type - np.uint16 or np.uint8
+            workers - the number of threads, by default the number of cores
+            chunk - how many datapoints a thread converts at a time
+        """
+
+        self.max_dac = max_dac
+        self.data_type = data_type
+        self.chunk = int(chunk)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers = self.workers)
+        self._local = threading.local()
+
+    def __call__ (self, array, out = None, overwrite = False):
+        """
+        TAKES:
+            array - an array with values between [-1 and 1], of any shape
+            out - (optional) the contiguous output array of data_type and the same size (e.g. a np.memmap)
+            overwrite - if True (and array is a float64 array), array is used as the scratch space and gets overwritten
+        RETURNS:
+            The transformed array in a binary format, of the shape of array (or out, if given)
+        """
+
+        shape = np.shape(array)
+        array = np.ravel(array)
+
+        if out is None:
+            out = np.empty(shape, dtype = self.data_type)
+        elif out.dtype != self.data_type or out.size != len(array) or not out.flags.c_contiguous:
+            raise ValueError("out should be a contiguous array of {0} with {1} datapoints.".format(np.dtype(self.data_type).name, len(array)))
+
+        out_flat = out.reshape(-1)
+
+        in_place = overwrite and array.dtype == np.float64 and array.flags.writeable
+
+        def convert (start):
+            stop = min(start + self.chunk, len(array))
+            if in_place:
+                scratch = array[start:stop]
+            else:
+                scratch = self._scratch()[:stop - start]
+                np.copyto(scratch, array[start:stop])
+            digital_conv_into(scratch, out_flat[start:stop], self.max_dac)
+
+        # list() waits for all the chunks and raises the first error, if any
+        list(self._pool.map(convert, range(0, len(array), self.chunk)))
+
+        return out
+
+    def _scratch (self):
+        """The float scratch buffer of the current thread."""
+
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._local.scratch = np.empty(self.chunk)
+        return scratch
+
+    def close (self):
+        """Stops the threads."""
+
+        self._pool.shutdown()
+
+
+
+_quantizers = {}
+
+def digital_conv_parallel (array, max_dac, data_type, out = None, overwrite = False, workers = None):
+    """This does the same as digital_conv_func, but over all the cores and without the intermediate arrays (see Quantizer).
+    The thread pools (and their scratch buffers) are kept and reused by the next calls.
+    TAKES: An array with values between [-1 and 1], of any shape
+           The range of the DAC
+           The data type (np.uint16, or np.uint8 for the 8-bit mode)
+           out - (optional) the contiguous output array of the same size
+           overwrite - whether the array may be used as scratch space (and overwritten)
+           workers - the number of threads, by default the number of cores
+    RETURNS: The transformed array in a binary format, of the same shape as the input"""
+
+    key = (max_dac, np.dtype(data_type), workers)
+    if key not in _quantizers:
+        _quantizers[key] = Quantizer(max_dac, data_type, workers)
+
+    return _quantizers[key](array, out, overwrite)
+
+
+
     #=============================================================#
     #=============================================================#
     #=============================================================#
@@ -96,27 +219,33 @@ def quitter (sid):
     
     
     
-def download_func (inst, wave, channel, segment):
+def download_func (inst, wave, channel, segment, max_dac = 65535, data_type = np.uint16):
 
     """This function downloads the waveforms down to the Proteus unit.
     TAKES:
         inst - the instance of the open instrument command
-        Wave - a binary array with the data of the waveform
+        Wave - a binary array with the data of the waveform, or a lazy waveform (see waveforms) that is evaluated only now
         Channel - the number of the channel, could take values - [1,2,3,4]
         Segment - assigned reference number of the segment in which we put the waveform
+        max_dac, data_type - the DAC range and data type (from connection_func), only used for lazy waveforms
 
     RETURNS: 
         Absolutely nothing :) (Except many good wishes)
     """
 
+    wave_size = len(wave) if isinstance(wave, waveforms.Waveform) else wave.size
+
     # download it to segment 1 of channel 1
     inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
-    inst.send_scpi_cmd(':TRAC:DEF {0},'.format(segment) + str(wave.size))
+    inst.send_scpi_cmd(':TRAC:DEF {0},'.format(segment) + str(wave_size))
     inst.send_scpi_cmd(':TRAC:SEL {0}'.format(segment))   # we are saying here basically "create for me a segment of memory with such and such length"
 
-    print('wave size: {0}'.format(wave.size))
+    print('wave size: {0}'.format(wave_size))
     # download the waveform to the selected segment
-    inst.write_binary_data(':TRAC:DATA', wave)  # put your wave there
+    if isinstance(wave, waveforms.Waveform):
+        write_lazy_waveform(inst, wave, max_dac, data_type)
+    else:
+        inst.write_binary_data(':TRAC:DATA', wave)  # put your wave there
 
     inst.send_scpi_cmd(':SOUR:FUNC:MODE:SEGM {0}'.format(segment))
     # inst.send_scpi_cmd(':SOUR:VOLT 0.5')  ### set voltage 
@@ -132,6 +261,743 @@ def download_func (inst, wave, channel, segment):
 
 
 
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+def write_lazy_waveform (inst, wave, max_dac, data_type, chunk = waveforms.CHUNK):
+
+    """This function evaluates a lazy waveform (see waveforms) chunk by chunk straight into one transfer buffer,
+    and writes every chunk at its offset in the selected segment (:TRAC:DATA <offset>,<data>).
+    So the memory used is set by the chunk size, not by the length of the waveform.
+    TAKES:
+        inst - the instance of the open instrument command
+        wave - the lazy waveform, with values between [-1 and 1]
+        max_dac - the range of the DAC
+        data_type - 8-bit or 16-bit type of dac mode
+        chunk - how many datapoints to evaluate and send at a time (a multiple of 64)
+
+    RETURNS: 
+        zero if succeeded; otherwise, error code of the failed transfer
+    """
+
+    if chunk % 64 != 0:
+        raise ValueError("The chunk size should be a multiple of 64 datapoints.")
+
+    transfer = np.empty(min(chunk, len(wave)), dtype=data_type)
+
+    blocks = (digital_conv_into(values, transfer[:len(values)], max_dac) for offset, values in wave.chunks(chunk))
+
+    return write_blocks(inst, blocks)
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+def write_blocks (inst, blocks):
+
+    """This function writes consecutive blocks of DAC data to the selected segment, every block at its offset
+    (:TRAC:DATA <offset>,<data>). The blocks can come from a generator, e.g. pulse.readout_pulse_stream,
+    so the whole waveform never has to be in memory.
+    TAKES:
+        inst - the instance of the open instrument command
+        blocks - iterable of binary arrays (uint16 or uint8), all but the last one a multiple of 64 datapoints
+
+    RETURNS: 
+        zero if succeeded; otherwise, error code of the failed transfer
+    """
+
+    offset = 0
+
+    for data in blocks:
+        ret_code = inst.write_binary_data(':TRAC:DATA {0},'.format(offset), data)
+        if ret_code:
+            return ret_code
+        offset += len(data)
+
+    return 0
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+def upload_npy (inst, filename, channel, segment, max_dac = 65535, data_type = np.uint16, chunk = waveforms.CHUNK, resume = False, define = True):
+
+    """This function uploads a waveform stored in a .npy file to a segment without loading it: the file is memory-mapped
+    and written chunk by chunk at its offset (:TRAC:DATA <offset>,<data>), so the host memory stays flat whatever the size.
+    The file can hold the DAC data (of data_type, sent straight from the file) or float values between [-1 and 1]
+    (converted a chunk at a time into one reused buffer).
+    After every chunk the offset reached is saved in <filename>.progress, so if the upload is interrupted (error, Ctrl-C, crash)
+    it can be continued from there with resume = True. The progress file is removed when the upload is complete.
+    TAKES:
+        inst - the instance of the open instrument command
+        filename - the .npy file (1-D array)
+        channel - the number of the channel
+        segment - the number of the segment
+        max_dac, data_type - the DAC range and data type (from connection_func)
+        chunk - how many datapoints to send at a time (a multiple of 64)
+        resume - continue an interrupted upload of the same file to the same channel and segment (from <filename>.progress)
+        define - define the segment first (:TRAC:DEF), not done when resuming
+
+    RETURNS: 
+        A dictionary with:
+            'points' - the length of the waveform
+            'start' - the offset the upload started from (non zero when resumed)
+            'chunks' - list of (offset, points, seconds, MB/s) of every chunk
+            'MBps' - the average throughput
+            'error' - zero if succeeded; otherwise, error code of the failed transfer (the upload can be resumed)
+    """
+
+    if chunk % 64 != 0:
+        raise ValueError("The chunk size should be a multiple of 64 datapoints.")
+
+    wave = np.load(filename, mmap_mode = 'r')
+    if wave.ndim != 1:
+        raise ValueError("The .npy file should hold a 1-D array.")
+
+    if wave.dtype == np.dtype(data_type):
+        transfer = None
+    elif wave.dtype.kind == 'f':
+        scratch = np.empty(min(chunk, len(wave)))
+        transfer = np.empty(min(chunk, len(wave)), dtype = data_type)
+    else:
+        raise ValueError("The .npy file should hold {0} DAC data or float values, not {1}.".format(np.dtype(data_type), wave.dtype))
+
+    progress_file = str(filename) + '.progress'
+    job = {'channel': int(channel), 'segment': int(segment), 'points': len(wave)}
+
+    start = 0
+    if resume and os.path.exists(progress_file):
+        with open(progress_file) as f:
+            saved = json.load(f)
+        if any(saved.get(key) != value for key, value in job.items()):
+            raise ValueError("The progress file {0} is of another upload: {1}".format(progress_file, saved))
+        start = int(saved['offset'])
+
+    inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
+    if start == 0 and define:
+        inst.send_scpi_cmd(':TRAC:DEF {0},{1}'.format(segment, len(wave)))
+    inst.send_scpi_cmd(':TRAC:SEL {0}'.format(segment))
+
+    report = {'points': len(wave), 'start': start, 'chunks': [], 'MBps': 0.0, 'error': 0}
+    total_bytes, total_time = 0, 0.0
+
+    for offset in range(start, len(wave), chunk):
+        stop = min(offset + chunk, len(wave))
+
+        t_0 = time.perf_counter()
+        if transfer is None:
+            data = wave[offset:stop]
+        else:
+            np.copyto(scratch[:stop - offset], wave[offset:stop])
+            data = digital_conv_into(scratch[:stop - offset], transfer[:stop - offset], max_dac)
+
+        ret_code = inst.write_binary_data(':TRAC:DATA {0},'.format(offset), data)
+        if ret_code:
+            report['error'] = ret_code
+            print('upload of {0} failed at offset {1} with error {2}, resume = True continues from there'.format(filename, offset, ret_code))
+            break
+        seconds = time.perf_counter() - t_0
+
+        nbytes = data.nbytes
+        total_bytes += nbytes
+        total_time += seconds
+        report['chunks'].append((offset, stop - offset, seconds, nbytes / seconds / 1e6 if seconds > 0 else float('inf')))
+
+        job['offset'] = stop
+        with open(progress_file + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(progress_file + '.tmp', progress_file)
+
+    else:
+        if os.path.exists(progress_file):
+            os.remove(progress_file)
+
+    if total_time > 0:
+        report['MBps'] = total_bytes / total_time / 1e6
+
+    print('uploaded {0} of {1} points from {2}, {3:.1f} MB/s'.format(
+        (report['chunks'][-1][0] + report['chunks'][-1][1] if report['chunks'] else start), len(wave), filename, report['MBps']))
+
+    return report
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+def bulk_download (inst, waves, channel, first_segment = 1, max_dac = 65535, data_type = np.uint16, use_table = True, min_len = 2048):
+
+    """This function uploads many waveforms (e.g. the segments of a sweep) to consecutive segments at once.
+    The waveforms are put one after the other in one buffer, each padded (with the zero of the DAC) up to the
+    format ( 64 * (32 + n)) and at least min_len, and the buffer is sent in a single :TRAC:DATA transfer to one segment
+    that is then split into the segments with the segment table (:TRAC:SEGM, pairs of uint32 start offset and length).
+    The errors are checked once, at the end, and a failed transfer raises RuntimeError.
+    With use_table = False the segments are defined in one batch of commands and the buffer is sent a segment at a time
+    (one :TRAC:SEL and one transfer per segment, no error check in between).
+    TAKES:
+        inst - the instance of the open instrument command
+        waves - list of the waveforms, binary arrays of data_type or float arrays with values between [-1 and 1]
+        channel - the number of the channel
+        first_segment - the segment number of the first waveform, the others follow it
+        max_dac, data_type - the DAC range and data type (from connection_func)
+        use_table - send everything in one transfer with the segment table
+        min_len - the minimal segment length
+
+    RETURNS: 
+        The segment table, a list of (segment, offset, length) of every waveform
+    """
+
+    lengths = []
+    for w in waves:
+        n = len(w)
+        lengths.append(max(n + formatter_for_sequences(n), min_len))
+
+    total = sum(lengths)
+    buffer = np.empty(total, dtype = data_type)
+
+    table = []
+    offset = 0
+    for i, (w, length) in enumerate(zip(waves, lengths)):
+        w = np.asarray(w)
+        if w.dtype.kind == 'f':
+            buffer[offset:offset + len(w)] = digital_conv_func(w, max_dac, data_type)
+        else:
+            buffer[offset:offset + len(w)] = w
+        buffer[offset + len(w):offset + length] = max_dac // 2
+        table.append((first_segment + i, offset, length))
+        offset += length
+
+    print('{0} segments, {1} datapoints in total'.format(len(table), total))
+
+    inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
+
+    if use_table:
+        inst.send_scpi_cmd(':TRAC:DEF {0},{1}'.format(first_segment, total))
+        inst.send_scpi_cmd(':TRAC:SEL {0}'.format(first_segment))
+        ret_code = inst.write_binary_data(':TRAC:DATA 0,', buffer)
+        if ret_code:
+            raise RuntimeError('Writing the buffer to segment {0} of channel {1} failed with error {2}.'.format(first_segment, channel, ret_code))
+
+        seg_table = np.array([(offset, length) for segment, offset, length in table], dtype = np.uint32)
+        ret_code = inst.write_binary_data(':TRAC:SEGM {0},'.format(first_segment), seg_table)
+        if ret_code:
+            raise RuntimeError('Writing the segment table of channel {0} failed with error {1}.'.format(channel, ret_code))
+    else:
+        with inst.batch():
+            for segment, offset, length in table:
+                inst.send_scpi_cmd(':TRAC:DEF {0},{1}'.format(segment, length))
+        for segment, offset, length in table:
+            inst.send_scpi_cmd(':TRAC:SEL {0}'.format(segment), paranoia_level = 0)
+            ret_code = inst.write_binary_data(':TRAC:DATA', buffer[offset:offset + length])
+            if ret_code:
+                raise RuntimeError('Writing segment {0} of channel {1} failed with error {2}.'.format(segment, channel, ret_code))
+
+    resp = inst.send_scpi_query(':SYST:ERR?')
+    print(resp)
+
+    del buffer
+
+    return table
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+class SegmentRegistry():
+    """
+    Remembers which segment of every channel already holds which waveform (by a hash of its binary data),
+    so the same waveform is downloaded only once: download gives back the segment that already has it.
+
+    Use one registry per instrument session, and forget() the segments that get deleted or overwritten by other means.
+    """
+
+    def __init__ (self, inst, max_dac = 65535, data_type = np.uint16):
+        """
+        TAKES:
+            inst - the instance of the open instrument command
+            max_dac, data_type - the DAC range and data type (from connection_func), only used for lazy waveforms
+        """
+
+        self.inst = inst
+        self.max_dac = max_dac
+        self.data_type = data_type
+        self._segments = {}  # channel -> {hash: segment}
+        self._hashes = {}    # channel -> {segment: hash}
+        self.hits = 0
+        self.uploads = 0
+        self.bytes_saved = 0
+        self.bytes_uploaded = 0
+
+    @staticmethod
+    def content_hash (wave):
+        """Hash of the binary data of the wave (with its data type and length)."""
+
+        data = np.ascontiguousarray(wave)
+        digest = hashlib.blake2b(memoryview(data).cast('B'), digest_size = 16)
+        digest.update('{0}{1}'.format(data.dtype.str, data.shape).encode())
+
+        return digest.hexdigest()
+
+    def download (self, wave, channel, segment):
+        """
+        Downloads the wave to the segment, unless some segment of the channel already holds the same data.
+
+        TAKES:
+            wave - a binary array with the data of the waveform (lazy waveforms are always downloaded)
+            channel - the number of the channel, could take values - [1,2,3,4]
+            segment - the segment to use if the data is new
+
+        RETURNS:
+            The segment number that holds the wave
+        """
+
+        if isinstance(wave, waveforms.Waveform):
+            self.forget(channel, segment)
+            download_func(self.inst, wave, channel, segment, self.max_dac, self.data_type)
+            self.uploads += 1
+            self.bytes_uploaded += len(wave) * np.dtype(self.data_type).itemsize
+            return segment
+
+        key = self.content_hash(wave)
+        segments = self._segments.setdefault(channel, {})
+
+        if key in segments:
+            self.hits += 1
+            self.bytes_saved += wave.nbytes
+            print('Segment {0} of channel {1} already holds this waveform, not downloading it again.'.format(segments[key], channel))
+            return segments[key]
+
+        self.forget(channel, segment)
+        download_func(self.inst, wave, channel, segment)
+        segments[key] = segment
+        self._hashes.setdefault(channel, {})[segment] = key
+        self.uploads += 1
+        self.bytes_uploaded += wave.nbytes
+
+        return segment
+
+    def forget (self, channel = None, segment = None):
+        """
+        Forgets what a segment holds (all the segments of the channel if segment is None, everything if channel is None too).
+        """
+
+        channels = list(self._hashes) if channel is None else [channel]
+
+        for ch in channels:
+            hashes = self._hashes.get(ch, {})
+            for seg in (list(hashes) if segment is None else [segment]):
+                key = hashes.pop(seg, None)
+                if key is not None:
+                    del self._segments[ch][key]
+
+    def stats (self):
+        """
+        RETURNS:
+            A dictionary with the number of hits (downloads skipped), uploads, bytes saved and bytes uploaded
+        """
+
+        return {'hits': self.hits, 'uploads': self.uploads,
+                'bytes_saved': self.bytes_saved, 'bytes_uploaded': self.bytes_uploaded}
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+class SegmentShadow():
+    """
+    Keeps a host copy (shadow) of what every segment holds, so when a waveform changes only in a small part
+    (e.g. one pulse of a long sequence in a calibration loop) only the blocks that changed are uploaded,
+    every range of changed blocks with an offset write (:TRAC:DATA <offset>,<data>).
+
+    Use one shadow per instrument session, and forget() the segments that get deleted or overwritten by other means.
+    """
+
+    def __init__ (self, inst, max_dac = 65535, data_type = np.uint16, block = 64, merge_gap = 4):
+        """
+        TAKES:
+            inst - the instance of the open instrument command
+            max_dac, data_type - the DAC range and data type (from connection_func), for float and lazy waveforms
+            block - the size of the compared blocks in datapoints (a multiple of 64)
+            merge_gap - ranges of changed blocks closer than this many blocks are sent as one write
+        """
+
+        if block <= 0 or block % 64 != 0:
+            raise ValueError("The block size should be a positive multiple of 64 datapoints.")
+
+        self.inst = inst
+        self.max_dac = max_dac
+        self.data_type = data_type
+        self.block = block
+        self.merge_gap = merge_gap
+        self._shadows = {}  # (channel, segment) -> binary array
+        self.full_uploads = 0
+        self.partial_uploads = 0
+        self.skipped_uploads = 0
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+
+    def _binary (self, wave):
+
+        if isinstance(wave, waveforms.Waveform):
+            wave = wave.render()
+        wave = np.asarray(wave)
+        if wave.dtype.kind == 'f':
+            return digital_conv_func(wave, self.max_dac, self.data_type)
+
+        return wave
+
+    def changed_ranges (self, old, new):
+        """
+        Finds the datapoints that differ, in whole blocks.
+
+        TAKES:
+            old, new - binary arrays of the same length
+
+        RETURNS:
+            List of (start, stop) datapoint ranges, the starts at block boundaries
+        """
+
+        block = self.block
+        full = len(new) // block * block
+
+        diff = np.flatnonzero((old[:full] != new[:full]).reshape(-1, block).any(axis = 1))
+        if full < len(new) and np.any(old[full:] != new[full:]):
+            diff = np.append(diff, full // block)
+
+        ranges = []
+        for b in diff:
+            start, stop = int(b) * block, min((int(b) + 1) * block, len(new))
+            if ranges and start - ranges[-1][1] <= self.merge_gap * block:
+                ranges[-1][1] = stop
+            else:
+                ranges.append([start, stop])
+
+        return [tuple(r) for r in ranges]
+
+    def update (self, wave, channel, segment):
+        """
+        Brings the segment up to the wave: the first time (or if the length changed) the whole wave is downloaded,
+        afterwards only the blocks that differ from the shadow.
+
+        TAKES:
+            wave - the waveform, a binary array, a float array with values between [-1 and 1] or a lazy waveform
+            channel - the number of the channel, could take values - [1,2,3,4]
+            segment - the number of the segment
+
+        RETURNS:
+            List of the (start, stop) datapoint ranges uploaded
+        """
+
+        new = self._binary(wave)
+        key = (channel, segment)
+        old = self._shadows.get(key)
+
+        if old is None or len(old) != len(new) or old.dtype != new.dtype:
+            download_func(self.inst, new, channel, segment)
+            self._shadows[key] = new.copy()
+            self.full_uploads += 1
+            self.bytes_uploaded += new.nbytes
+            return [(0, len(new))]
+
+        ranges = self.changed_ranges(old, new)
+
+        if not ranges:
+            # the segment already holds the wave, nothing is sent
+            self.skipped_uploads += 1
+            self.bytes_saved += new.nbytes
+            return ranges
+
+        self.inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
+        self.inst.send_scpi_cmd(':TRAC:SEL {0}'.format(segment))
+
+        sent = 0
+        for start, stop in ranges:
+            ret_code = self.inst.write_binary_data(':TRAC:DATA {0},'.format(start), new[start:stop])
+            if ret_code:
+                # the segment is not known any more
+                self.forget(channel, segment)
+                raise RuntimeError('Writing segment {0} of channel {1} at {2} failed with error {3}.'.format(segment, channel, start, ret_code))
+            old[start:stop] = new[start:stop]
+            sent += (stop - start) * new.itemsize
+
+        self.partial_uploads += 1
+        self.bytes_uploaded += sent
+        self.bytes_saved += new.nbytes - sent
+
+        print('Segment {0} of channel {1}: {2} ranges, {3} of {4} bytes uploaded.'.format(segment, channel, len(ranges), sent, new.nbytes))
+
+        return ranges
+
+    def forget (self, channel = None, segment = None):
+        """
+        Forgets the shadow of a segment (all the segments of the channel if segment is None, everything if channel is None too).
+        """
+
+        for key in list(self._shadows):
+            if (channel is None or key[0] == channel) and (segment is None or key[1] == segment):
+                del self._shadows[key]
+
+    def stats (self):
+        """
+        RETURNS:
+            A dictionary with the number of full, partial and skipped (nothing changed) uploads, bytes uploaded and bytes saved
+        """
+
+        return {'full_uploads': self.full_uploads, 'partial_uploads': self.partial_uploads,
+                'skipped_uploads': self.skipped_uploads,
+                'bytes_uploaded': self.bytes_uploaded, 'bytes_saved': self.bytes_saved}
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+class SegmentAllocator():
+    """
+    Hands out the segment numbers of one channel (its DDR) and keeps track of the waveform memory they take.
+    When a new waveform does not fit, the least recently used segments are deleted (:TRAC:DEL) to make room,
+    instead of deleting everything and downloading it all again.
+
+    The memory is tracked as a list of segments placed one after the other, first fit, the way the segments are defined.
+    Deleted segments leave holes, fragmentation() tells how scattered the free memory is and defragment() packs it.
+    """
+
+    def __init__ (self, inst, channel, max_dac = 65535, data_type = np.uint16, capacity = None, max_segment = None, registry = None):
+        """
+        TAKES:
+            inst - the instance of the open instrument command
+            channel - the number of the channel, could take values - [1,2,3,4]
+            max_dac, data_type - the DAC range and data type (from connection_func)
+            capacity - the waveform memory in bytes, by default the :TRACe:FREE? of the channel now
+            max_segment - the largest segment number, by default :TRACe:SELect:SEGMent? MAX
+            registry - (optional) a SegmentRegistry to tell about the deleted segments
+        """
+
+        self.inst = inst
+        self.channel = channel
+        self.max_dac = max_dac
+        self.data_type = data_type
+        self.registry = registry
+
+        inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
+
+        if capacity is None:
+            capacity = int(inst.send_scpi_query(':TRACe:FREE?'))
+        if max_segment is None:
+            max_segment = int(inst.send_scpi_query(':TRACe:SELect:SEGMent? MAX'))
+
+        self.capacity = int(capacity)
+        self.max_segment = int(max_segment)
+        self.evictions = 0
+        self._used = OrderedDict()  # segment -> [address, nbytes], least recently used first
+        self._pinned = set()
+
+    def allocate (self, nbytes):
+        """
+        Picks a free segment number and room for nbytes of waveform data, deleting least recently used segments if needed.
+
+        TAKES:
+            nbytes - the size of the waveform in bytes
+
+        RETURNS:
+            The segment number (defined on the instrument only when the waveform is downloaded to it)
+        """
+
+        nbytes = int(nbytes)
+
+        if nbytes > self.capacity:
+            raise MemoryError('{0:,} bytes do not fit in the {1:,} bytes of channel {2}.'.format(nbytes, self.capacity, self.channel))
+
+        address = self._find_room(nbytes)
+
+        while address is None or len(self._used) >= self.max_segment:
+            if self.free_bytes() >= nbytes and len(self._used) < self.max_segment:
+                self.defragment()
+            else:
+                self._evict()
+            address = self._find_room(nbytes)
+
+        segment = 1
+        while segment in self._used:
+            segment += 1
+
+        self._used[segment] = [address, nbytes]
+
+        return segment
+
+    def download (self, wave):
+        """
+        Downloads the wave (with download_func) to a newly allocated segment.
+
+        TAKES:
+            wave - a binary array with the data of the waveform, or a lazy waveform
+
+        RETURNS:
+            The segment number
+        """
+
+        nbytes = len(wave) * np.dtype(self.data_type).itemsize
+        segment = self.allocate(nbytes)
+        download_func(self.inst, wave, self.channel, segment, self.max_dac, self.data_type)
+
+        return segment
+
+    def touch (self, segment):
+        """Marks the segment as just used (e.g. when it is put in a task table), so it is evicted last."""
+
+        self._check_known(segment)
+        self._used.move_to_end(segment)
+
+    def pin (self, segment, pinned = True):
+        """Protects the segment from eviction (or stops protecting it with pinned = False), e.g. while it is playing."""
+
+        if pinned:
+            self._pinned.add(segment)
+        else:
+            self._pinned.discard(segment)
+
+    def release (self, segment):
+        """Deletes the segment on the instrument and frees its memory."""
+
+        self._check_known(segment)
+        self.inst.send_scpi_cmd(':INST:CHAN {0}'.format(self.channel))
+        self.inst.send_scpi_cmd(':TRAC:DEL {0}'.format(segment))
+        del self._used[segment]
+        self._pinned.discard(segment)
+
+        if self.registry is not None:
+            self.registry.forget(self.channel, segment)
+
+    def _check_known (self, segment):
+
+        if segment not in self._used:
+            raise ValueError('Segment {0} of channel {1} is not held by the allocator (downloaded by other means, or already released).'.format(segment, self.channel))
+
+    def _evict (self):
+
+        for segment in self._used:
+            if segment not in self._pinned:
+                print('Deleting segment {0} of channel {1} to make room.'.format(segment, self.channel))
+                self.release(segment)
+                self.evictions += 1
+                return
+
+        raise MemoryError('All the segments of channel {0} are pinned, no room can be made.'.format(self.channel))
+
+    def _holes (self):
+        """The free stretches of memory as (address, nbytes), in address order."""
+
+        holes = []
+        address = 0
+
+        for start, nbytes in sorted(self._used.values()):
+            if start > address:
+                holes.append((address, start - address))
+            address = start + nbytes
+
+        if self.capacity > address:
+            holes.append((address, self.capacity - address))
+
+        return holes
+
+    def _find_room (self, nbytes):
+
+        for address, size in self._holes():
+            if size >= nbytes:
+                return address
+
+        return None
+
+    def defragment (self):
+        """Packs the segments together on the instrument (:TRAC:DEFR), so all the free memory is in one piece."""
+
+        self.inst.send_scpi_cmd(':INST:CHAN {0}'.format(self.channel))
+        self.inst.send_scpi_cmd(':TRAC:DEFR')
+
+        address = 0
+        for segment in sorted(self._used, key = lambda seg: self._used[seg][0]):
+            self._used[segment][0] = address
+            address += self._used[segment][1]
+
+    def free_bytes (self):
+
+        return self.capacity - sum(nbytes for address, nbytes in self._used.values())
+
+    def fragmentation (self):
+        """
+        RETURNS:
+            A dictionary with the number of segments, used and free bytes, the largest free piece,
+            the number of free pieces, the fragmentation (1 - largest free piece / free bytes, 0 when in one piece)
+            and the number of evictions so far
+        """
+
+        holes = self._holes()
+        free = sum(size for address, size in holes)
+        largest = max([size for address, size in holes] + [0])
+
+        return {'segments': len(self._used), 'used_bytes': self.capacity - free, 'free_bytes': free,
+                'largest_free': largest, 'free_pieces': len(holes),
+                'fragmentation': 1 - largest / free if free else 0.0, 'evictions': self.evictions}
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+    
+    
+    
+    
+def parallel_download (multi, jobs, max_dac = 65535, data_type = np.uint16):
+
+    """This function downloads waveforms to several modules at once (tep_multi.MultiSlotSession),
+    every module on its own thread, the waveforms of one module one after the other (with download_func).
+    TAKES:
+        multi - the MultiSlotSession of the modules
+        jobs - dictionary of slot id to a list of (wave, channel, segment)
+        max_dac, data_type - the DAC range and data type (from connection_func), only used for lazy waveforms
+
+    RETURNS: 
+        The timings (see tep_multi.MultiSlotSession.map): seconds per slot, the wall time and the speedup
+    """
+
+    def download (inst, items):
+        for wave, channel, segment in items:
+            download_func(inst, wave, channel, segment, max_dac, data_type)
+
+    results, timings = multi.map(download, dict((sid, (items,)) for sid, items in jobs.items()))
+
+    print('Waveforms of {0} modules downloaded in {1:.3f} s (x{2:.1f} over one at a time)'.format(len(jobs), timings['wall'], timings['speedup']))
+
+    return timings
+
+
+
     #=============================================================#
     #=============================================================#
     #=============================================================#
@@ -174,28 +1040,60 @@ def task_starter (inst, channel):
     #=============================================================#
     
     
-def concatenator (*array):
+def concatenator (*array, align = None, pad_value = 0, out = None):
     
     """
     This function takes any number of arrays as arguments.
+    The total length is summed up first and the result is allocated once, in the data type of the arrays
+    (binary segments stay binary), or written straight into out.
     
     INPUT:
         Arrays
+        align - None for no padding, 'end' to pad the end of the result, 'each' to pad every array,
+                up to the format ( 64 * (32 + n)) (see formatter_for_sequences)
+        pad_value - the value of the padding datapoints, e.g. max_dac // 2 for the zero of binary data
+        out - (optional) the array to write to, at least as long as the result (e.g. a np.memmap),
+              or a file name: the result is then made as a memory-mapped .npy file there
         
     OUTPUT:
-        Concatonated array
+        Concatonated array (a view on the start of out, if it was given)
     """
     
     print ('{0} of datasegments given.\n'.format(len(array)))
     print ('Concatonating the datasegments...')
-    
-    l = []
-    for i in range(len(array)):
-        l = np.concatenate((l,array[i]), axis = None)
+
+    array = [np.ravel(a) for a in array]
+    lengths = [len(a) for a in array]
+
+    if align == 'each':
+        pads = [formatter_for_sequences(n) for n in lengths]
+    elif align == 'end':
+        pads = [0] * (len(array) - 1) + [formatter_for_sequences(sum(lengths))]
+    elif align is None:
+        pads = [0] * len(array)
+    else:
+        raise ValueError("align should be None, 'end' or 'each'.")
+
+    total = sum(lengths) + sum(pads)
+    data_type = np.result_type(*array) if array else np.float64
+
+    if out is None:
+        out = np.empty(total, dtype = data_type)
+    elif isinstance(out, (str, os.PathLike)):
+        out = np.lib.format.open_memmap(out, mode = 'w+', dtype = data_type, shape = (total,))
+    elif len(out) < total:
+        raise ValueError("out has {0} datapoints, {1} are needed.".format(len(out), total))
+
+    position = 0
+    for a, pad in zip(array, pads):
+        out[position:position + len(a)] = a
+        position += len(a)
+        out[position:position + pad] = pad_value
+        position += pad
         
-    print ("The length of the new dataset is:", len(l))
+    print ("The length of the new dataset is:", total)
     
-    return l
+    return out[:total]
 
 
     
@@ -242,27 +1140,60 @@ def start_task(inst, channel):
     #=============================================================#
 
 
-def IQ_interleaver(I_array, Q_array):
+def IQ_interleaver(I_array, Q_array, out = None):
     
     """
     Intertwines 2 signals, thus preparin them for I, Q modulation.
     At IQ ONE modulation mode (the one used here), the I and Q arrays are stored in one array.
     This array has the every second entry filled with I data and the other ones with Q data.
+    To skip this copy altogether, make the pulses straight into an IQ_buffer.
     
     INPUT:
         I_array - I data array
-        Q_array - Q data array
+        Q_array - Q data array (the same length)
+        out - (optional) array of twice the length to write to
+    
+    OUTPUT: 
+        Intertwinded array (of the data type of the inputs)
+    """
+    
+    I_array = np.asarray(I_array)
+    Q_array = np.asarray(Q_array)
+
+    if len(I_array) != len(Q_array):
+        raise ValueError("The I and Q arrays should have the same length.")
+
+    if out is None:
+        out = np.empty(len(I_array) + len(Q_array), dtype=np.result_type(I_array, Q_array))
+
+    out[0::2] = I_array
+    out[1::2] = Q_array
+    
+    return out
+
+
+
+def IQ_buffer(seglen, data_type = np.uint16):
+    
+    """
+    Allocates one interleaved I/Q array for IQ ONE modulation, and gives the views on its I (even) and Q (odd) entries.
+    The pulse_lib methods given out = (I_view, Q_view) quantize I and Q straight into it, so there is no interleaving copy:
+        inter_array, I, Q = helpers.IQ_buffer(seglen, data_type)
+        pulse.readout_pulse(..., out = (I, Q))
+    
+    INPUT:
+        seglen - the number of datapoints of I (and of Q)
+        data_type - 8-bit or 16-bit type of dac mode
     
     OUTPUT: 
-        Intertwinded array
+        inter_array - the interleaved array, 2 * seglen long, to download
+        I_view - the view on the I entries
+        Q_view - the view on the Q entries
     """
     
-    inter_array = np.empty(len(I_array) + len(Q_array))
-    for i in range(0, len(Q_array)):
-        inter_array[0+i*2] = I[i]
-        inter_array[1+i*2] = Q[i]
+    inter_array = np.empty(2 * seglen, dtype=data_type)
     
-    return inter_array
+    return inter_array, inter_array[0::2], inter_array[1::2]
 
 
 
@@ -1,6 +1,7 @@
 import os
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
+from tep_multi import MultiSlotSession
 import numpy as np
 
 
@@ -91,6 +92,57 @@ def connection_func ():
     return dac_mode, max_dac, sid, data_type, inst
 
 
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+def multi_connection_func (slot_ids = None):
+    """This function connects to all the Proteus modules of the chassis (or the ones given), every module as an
+    instrument of its own with its own worker thread (see tep_multi), so the uploads and task-tables of the modules
+    can be done in parallel (helpers.parallel_download, tasks.parallel_task_rows).
+    
+    INPUTS: 
+        slot_ids - the slots to connect to, by default all of them
+
+    OUTPUTS: 
+        dac_mode - This is the single dataoint resolution mode of the DAC it can be 8 or 16-bit
+        max_dac - the total vertical resolution of the DAC
+        slot_ids - the slot numbers of the modules
+        data_type - 8-bit or 16-bit type of dac mode
+        multi - the MultiSlotSession of the modules (multi.inst(sid) is the instance of one module)"""
+    
+    print("\n=========CONNECTING=========")
+
+    admin = TepAdmin()
+
+    multi = MultiSlotSession(admin, slot_ids)
+
+    idns = multi.send_scpi_query('*IDN?')
+    models = multi.send_scpi_query(":SYST:iNF:MODel?")
+    for sid in multi.slot_ids:
+        multi.inst(sid).default_paranoia_level = 2
+        print('Slot {0} connected to: {1}, model: {2}'.format(sid, idns[sid], models[sid]))
+
+    print("===CONNECTION ESTABLISHED===")
+    print("============================")
+
+    # Infer the natural DAC waveform format (all the modules should be the same)
+    if any('P9082' in model for model in models.values()):
+        dac_mode = 8
+        max_dac = 255
+        data_type = np.uint8
+    else:
+        dac_mode = 16
+        max_dac = 65535
+        data_type = np.uint16
+    print("DAC waveform format: {0} bits-per-point".format(dac_mode))
+
+    print("==========READY============")
+    print("===========================")
+    
+    return dac_mode, max_dac, multi.slot_ids, data_type, multi
+
+
     #=============================================================#
     #=============================================================#
     #=============================================================#
@@ -1,17 +1,285 @@
 
 import os
+import math
+from collections import OrderedDict
+from fractions import Fraction
 import numpy as np
 import matplotlib.pyplot as plt
 import helpers
+import waveforms
+
+
+class _WaveformCache():
+    """
+    A least-recently-used cache of read-only numpy arrays (envelopes, carriers...) with a memory ceiling in bytes.
+    The arrays are built on a miss by a given function and are never modified afterwards.
+    """
+
+    def __init__ (self, max_bytes):
+
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get (self, key, build):
+        """
+        Returns the array stored under key, building (and storing) it with build() on a miss.
+        Least recently used entries are dropped until the cache fits in max_bytes again.
+        """
+
+        array = self._entries.get(key)
+
+        if array is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return array
+
+        self.misses += 1
+        array = build()
+        array.setflags(write=False)
+
+        if array.nbytes <= self.max_bytes:
+            self._entries[key] = array
+            self.nbytes += array.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+        return array
+
+    def clear (self):
+
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info (self):
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+class NCO():
+    """
+    Phase-continuous carrier generator (numerically controlled oscillator) that can be shared by many pulses.
+
+    It keeps a running time base (position, in datapoints) and a phase accumulator per frequency,
+    so pulses that are later concatenated (helpers.concatenator) stay phase-coherent with each other.
+    The carriers are filled block by block: a precomputed rotation table of the frequency is multiplied
+    by the phase of the block, so no sin/cos is evaluated per datapoint.
+    """
+
+    def __init__ (self, SCLK, block = 4096):
+        """
+        INPUTS:
+            SCLK - the sampling clock rate [1/sec] of the time base
+            block - the length of the rotation tables in datapoints
+        """
+
+        self.SCLK = SCLK
+        self.block = int(block)
+        self.reset()
+
+    def reset (self):
+        """Sets the time base back to zero and forgets the phase of all frequencies."""
+
+        self.position = 0
+        self._phases = {}  # frequency -> [phase in cycles, position at which it was taken]
+        self._tables = {}  # frequency -> exp(2j*pi*f/SCLK*k) for k in range(block)
+
+    def advance (self, seglen):
+        """Moves the time base forward by seglen datapoints (a pulse or a blank that has been placed)."""
+
+        self.position += int(seglen)
+
+    def _phase (self, frequency):
+        """
+        The phase (in cycles) of the frequency at the current position.
+        The accumulator is exact (rational), so the phase does not drift however long the time base gets.
+        """
+
+        acc = self._phases.get(frequency)
+
+        if acc is None:
+            acc = [Fraction(0), 0]
+
+        acc[0] = (acc[0] + Fraction(frequency) / Fraction(self.SCLK) * (self.position - acc[1])) % 1
+        acc[1] = self.position
+        self._phases[frequency] = acc
+
+        return float(acc[0])
+
+    def carrier (self, frequency, seglen, offset = 0):
+        """
+        Gives the carrier for the datapoints [position + offset, position + offset + seglen), without moving the time base.
+
+        INPUTS:
+            frequency - of the carrier in [Hz]
+            seglen - how many datapoints
+            offset - where to start, in datapoints from the current position
+
+        OUTPUTS:
+            sin - the sin carrier
+            cos - the cos carrier
+        """
+
+        step = frequency / self.SCLK
+
+        table = self._tables.get(frequency)
+        if table is None:
+            table = np.exp(2j*np.pi*step*np.arange(self.block))
+            self._tables[frequency] = table
+
+        phase = self._phase(frequency)
+
+        phasor = np.empty(seglen, dtype=complex)
+        for start in range(0, seglen, self.block):
+            stop = min(start + self.block, seglen)
+            block_phase = phase + math.fmod(step * (offset + start), 1.0)
+            np.multiply(table[:stop - start], np.exp(2j*np.pi*block_phase), out=phasor[start:stop])
+
+        return phasor.imag, phasor.real
+
 
 class Pulse():
     """This is a class containing all the pulses one may wish for."""
     
-    def __init__ (self, SCLK, DUC_INTERP, show_plot = False):
+    def __init__ (self, SCLK, DUC_INTERP, show_plot = False, cache_max_bytes = 64*1024**2, nco = None):
         
         self.SCLK = SCLK
         self.DUC_INTERP = DUC_INTERP
         self.show_plot = show_plot
+        self.nco = nco  # if given (an NCO), the carriers are taken from it and stay phase-continuous from pulse to pulse
+        self._cache = _WaveformCache(cache_max_bytes)  # envelopes and carriers, reused when only the amplitude changes
+
+
+    def cache_info (self):
+        """
+        Gives the state of the envelope/carrier cache.
+
+        RETURNS:
+            A dictionary with the number of hits, misses, entries, the used bytes and the memory ceiling (max_bytes)
+        """
+
+        return self._cache.info()
+
+
+    def clear_cache (self, max_bytes = None):
+        """
+        Empties the envelope/carrier cache and resets its counters.
+
+        TAKES:
+            max_bytes - new memory ceiling of the cache in bytes (optional)
+        """
+
+        self._cache.clear()
+
+        if max_bytes is not None:
+            self._cache.max_bytes = int(max_bytes)
+
+
+    def _gaussian_envelope (self, sigma, width_over_sigma, seglen_gauss, ss, normalization_factor):
+        """Unit amplitude gaussian envelope of gaussian_pulse / gaussian_drag_pulse, taken from the cache."""
+
+        def build ():
+            t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
+            return (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+
+        return self._cache.get(('gaussian', sigma, width_over_sigma, self.SCLK, self.DUC_INTERP), build)
+
+
+    def _gaussian_drag_term (self, sigma, width_over_sigma, seglen_gauss, ss, normalization_factor):
+        """The (t/ss * envelope) term of the DRAG correction, taken from the cache."""
+
+        def build ():
+            t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
+            return t/ss * self._gaussian_envelope(sigma, width_over_sigma, seglen_gauss, ss, normalization_factor)
+
+        return self._cache.get(('gaussian_drag', sigma, width_over_sigma, self.SCLK, self.DUC_INTERP), build)
+
+
+    def _gaussian_carrier (self, sigma, width_over_sigma, frequency, seglen_gauss, GAUS_FC):
+        """The sin and cos carriers of gaussian_pulse / gaussian_drag_pulse (as 2 rows), taken from the cache."""
+
+        def build ():
+            t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
+            return np.stack((np.sin(2*np.pi*t*GAUS_FC), np.cos(2*np.pi*t*GAUS_FC)))
+
+        return self._cache.get(('gaussian_carrier', sigma, width_over_sigma, self.SCLK, self.DUC_INTERP, frequency), build)
+
+
+    synth_chunk = 2**16  # points synthesized at a time when writing straight into DAC buffers
+
+    def _synthesize_into (self, out, seglen, chunk):
+        """
+        Evaluates chunk(n) over the point indices n of a segment, synth_chunk points at a time,
+        and quantizes the I and Q it returns straight into the DAC buffers given in out.
+        So only chunk sized float arrays exist at any time, whatever the segment length.
+        At the end the NCO (if any) is moved past the segment.
+
+        INPUTS:
+            out - a pair (I, Q) of uint16 or uint8 arrays with seglen points each
+            seglen - the segment length in datapoints
+            chunk - function that takes an array of point indices (and the NCO origin) and returns the (I, Q) values there
+
+        OUTPUTS:
+            The out pair, filled with the DAC values
+        """
+
+        out_i, out_q = out
+        origin = self.nco.position if self.nco is not None else 0
+
+        for buff in (out_i, out_q):
+            if not isinstance(buff, np.ndarray) or buff.dtype not in (np.uint16, np.uint8) or buff.shape != (seglen,):
+                raise ValueError("out should be a pair of uint16 or uint8 arrays with {0} datapoints each".format(seglen))
+
+        for start in range(0, seglen, self.synth_chunk):
+            stop = min(start + self.synth_chunk, seglen)
+            (i), (q) = chunk(np.arange(start, stop), origin)
+            helpers.digital_conv_into((i), out_i[start:stop], np.iinfo(out_i.dtype).max)
+            helpers.digital_conv_into((q), out_q[start:stop], np.iinfo(out_q.dtype).max)
+
+        if self.nco is not None:
+            self.nco.advance(seglen)
+
+        return out_i, out_q
+
+
+    def _nco_carrier (self, cycles, n, origin):
+        """
+        The sin and cos carriers from the NCO at the consecutive point indices n of a pulse
+        that starts at the NCO position origin (cycles - carrier cycles per datapoint).
+        """
+
+        return self.nco.carrier(cycles * self.nco.SCLK, len(n), offset = origin + int(n[0]) - self.nco.position)
+
+
+    def _lazy_pulse (self, seglen, chunk):
+        """
+        Gives the (I, Q) of a pulse as lazy waveforms (waveforms.Generated) that call chunk only when rendered.
+        The NCO (if any) is moved past the pulse right away, so the pulse keeps its place in the time base.
+        """
+
+        origin = self.nco.position if self.nco is not None else 0
+
+        if self.nco is not None:
+            self.nco.advance(seglen)
+
+        return waveforms.Generated.pair(seglen, lambda n: chunk(n, origin))
+
+
+    def _trapezoid_envelope (self, n, delta_bytes_slope, tot_seglen):
+        """Unit amplitude envelope of trapezoid_pulse / readout_pulse at the point indices n."""
+
+        k = np.minimum(n, tot_seglen - 1 - n)  # distance from the closest edge of the pulse
+        step = (np.pi/2) / (delta_bytes_slope - 1) if delta_bytes_slope > 1 else 0.0
+
+        return np.where(k < delta_bytes_slope, np.sin(k*step), 1.0)
+
         
     def blank_signal (self, DC_bias = 0):
         
@@ -36,6 +304,9 @@ class Pulse():
         x = np.linspace(start=0, stop=1, num=seglen, endpoint=False)
         y= DC_bias*x
 
+        if self.nco is not None:
+            self.nco.advance(seglen)
+
         if self.show_plot == True:
             plt.plot(x,y)
 
@@ -88,7 +359,7 @@ class Pulse():
     
     
     
-    def gaussian_pulse (self, amplitude, sigma, width_over_sigma, frequency):
+    def gaussian_pulse (self, amplitude, sigma, width_over_sigma, frequency, out = None, lazy = False):
         """
         This method preapares a gaussian pulse.
         
@@ -97,6 +368,9 @@ class Pulse():
             sigma - the sigma of the gaussian in [sec]
             width_over_sigma - how many sigmas wide is the pulse [sec] RECOMENDED VALUE == 4 or 5
             frequency - of the signal in [Hz]
+            out - (optional) a pair (I, Q) of uint16/uint8 arrays with the segment length, if given the pulse
+                  is quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I, Q) pair is returned as lazy waveforms (see waveforms)
         
         OUTPUTS:
             I - component of the signal
@@ -136,8 +410,6 @@ class Pulse():
 
     ###########################################################
 
-        t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
-
         ss = sigma_numerical / seglen_gauss
 
         GAUS_FC = frequency * seglen_gauss * self.DUC_INTERP /2 / self.SCLK
@@ -145,16 +417,37 @@ class Pulse():
     #     print('Gaussian frequency = {0}[Mhz]'.format(SCLK * 2 * GAUS_FC / seglen_gauss / 1e6/ DUC_INTERP))  # the actual frequency of the sin wave in the gaussian
         print('Gaussian frequency = {0}[Mhz]'.format(self.SCLK * 2 * GAUS_FC / seglen_gauss / 1e6))  # the actual frequency of the sin wave in the gaussian
 
+        if out is not None or lazy:
+
+            def chunk (n, origin):
+                t = -1 + n*(2/seglen_gauss)
+                gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+                if self.nco is None:
+                    sin, cos = np.sin(2*np.pi*t*GAUS_FC), np.cos(2*np.pi*t*GAUS_FC)
+                else:
+                    sin, cos = self._nco_carrier(2*GAUS_FC/seglen_gauss, n, origin)
+                return sin*gaussian, cos*gaussian
+
+            if lazy:
+                return self._lazy_pulse(seglen_gauss, chunk)
+
+            return self._synthesize_into(out, seglen_gauss, chunk)
+
         ####################
-        sin = np.sin(2*np.pi*t*GAUS_FC)
-        cos = np.cos(2*np.pi*t*GAUS_FC)
-        gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+        envelope = self._gaussian_envelope(sigma, width_over_sigma, seglen_gauss, ss, normalization_factor)
+        if self.nco is None:
+            sin, cos = self._gaussian_carrier(sigma, width_over_sigma, frequency, seglen_gauss, GAUS_FC)
+        else:
+            sin, cos = self.nco.carrier(self.nco.SCLK*2*GAUS_FC/seglen_gauss, seglen_gauss)
+            self.nco.advance(seglen_gauss)
+        gaussian = amplitude * envelope
         (i) = sin*gaussian
         (q) = cos*gaussian
         magn = (i) + (q)
         ####################
 
         if self.show_plot == True:
+            t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
             plt.plot(t, (i), '-',t, (q), '-')
             plt.legend(['I','Q'])
 
@@ -171,7 +464,7 @@ class Pulse():
     
     
     
-    def gaussian_drag_pulse (self, amplitude, sigma, width_over_sigma, beta, frequency):
+    def gaussian_drag_pulse (self, amplitude, sigma, width_over_sigma, beta, frequency, out = None, lazy = False):
         """
         This method preapares a gaussian pulse with DRAG.
         
@@ -181,6 +474,9 @@ class Pulse():
             width_over_sigma - how many sigmas wide is the pulse [sec] RECOMENDED VALUE == 4 or 5
             beta - the DRAG coefficient (adjust accordingly depending on the qubit)
             frequency - of the signal in [Hz]
+            out - (optional) a pair (I, Q) of uint16/uint8 arrays with the segment length, if given the pulse
+                  is quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I, Q) pair is returned as lazy waveforms (see waveforms)
         
         OUTPUTS:
             I - component of the signal
@@ -223,8 +519,6 @@ class Pulse():
 
     ###########################################################
 
-        t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
-
         ss = sigma_numerical / seglen_gauss
 
         GAUS_FC = frequency * seglen_gauss * self.DUC_INTERP /2 / self.SCLK
@@ -232,17 +526,39 @@ class Pulse():
     #     print('Gaussian frequency = {0}[Mhz]'.format(SCLK * 2 * GAUS_FC / seglen_gauss / 1e6/ DUC_INTERP))  # the actual frequency of the sin wave in the gaussian
         print('Gaussian frequency = {0}[Mhz]'.format(self.SCLK * 2 * GAUS_FC / seglen_gauss / 1e6))  # the actual frequency of the sin wave in the gaussian
 
+        if out is not None or lazy:
+
+            def chunk (n, origin):
+                t = -1 + n*(2/seglen_gauss)
+                gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+                if self.nco is None:
+                    sin, cos = np.sin(2*np.pi*t*GAUS_FC), np.cos(2*np.pi*t*GAUS_FC)
+                else:
+                    sin, cos = self._nco_carrier(2*GAUS_FC/seglen_gauss, n, origin)
+                return sin*gaussian, cos*(1 - beta*t/ss*2)*gaussian
+
+            if lazy:
+                return self._lazy_pulse(seglen_gauss, chunk)
+
+            return self._synthesize_into(out, seglen_gauss, chunk)
+
         ####################
-        sin = np.sin(2*np.pi*t*GAUS_FC)
-        cos = np.cos(2*np.pi*t*GAUS_FC)
-        gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
-        gaussian_dragged = amplitude * (1 - beta*t/ss*2) * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+        envelope = self._gaussian_envelope(sigma, width_over_sigma, seglen_gauss, ss, normalization_factor)
+        if self.nco is None:
+            sin, cos = self._gaussian_carrier(sigma, width_over_sigma, frequency, seglen_gauss, GAUS_FC)
+        else:
+            sin, cos = self.nco.carrier(self.nco.SCLK*2*GAUS_FC/seglen_gauss, seglen_gauss)
+            self.nco.advance(seglen_gauss)
+        gaussian = amplitude * envelope
+        gaussian_dragged = envelope - 2*beta*self._gaussian_drag_term(sigma, width_over_sigma, seglen_gauss, ss, normalization_factor)
+        gaussian_dragged *= amplitude
         (i) = sin*gaussian
         (q) = cos*gaussian_dragged
         magn = (i) + (q)
         ####################
 
         if self.show_plot == True:
+            t = np.linspace(-1, 1, seglen_gauss, endpoint=False)
             plt.plot(t, (i), '-',t, (q), '-')
             plt.legend(['I','Q'])
 
@@ -259,7 +575,7 @@ class Pulse():
     
     
     
-    def sin_pulse (self, amplitude, width, frequency):
+    def sin_pulse (self, amplitude, width, frequency, out = None, lazy = False):
         """
         This funtion prepares a sin shaped pulse (the envelope of the pulse has a sinis shape).
 
@@ -267,6 +583,9 @@ class Pulse():
             amplitude - the amplitude scaler of the signal, takes value [0 to 1]
             width - of the pulse [sec]
             frequency - of the signal
+            out - (optional) a pair (I, Q) of uint16/uint8 arrays with the segment length, if given the pulse
+                  is quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I, Q) pair is returned as lazy waveforms (see waveforms)
 
         OUTPUTS:
             I component of the signal
@@ -292,6 +611,23 @@ class Pulse():
 
         seglen_pulse, normalization_factor = helpers.formatter(seglen_pulse)
 
+        if out is not None or lazy:
+            FC = 5 * frequency * seglen_pulse * self.DUC_INTERP /2 / self.SCLK
+
+            def chunk (n, origin):
+                t = n*(1/seglen_pulse)
+                sin_envelope = amplitude * np.sin(np.pi*t)
+                if self.nco is None:
+                    sin, cos = np.sin(2*np.pi*t*FC), np.cos(2*np.pi*t*FC)
+                else:
+                    sin, cos = self._nco_carrier(FC/seglen_pulse, n, origin)
+                return sin*sin_envelope, cos*sin_envelope
+
+            if lazy:
+                return self._lazy_pulse(seglen_pulse, chunk)
+
+            return self._synthesize_into(out, seglen_pulse, chunk)
+
         t = np.linspace(start= 0, stop= 1, num= seglen_pulse, endpoint= False) 
         x = np.linspace(start= 0, stop= np.pi, num= seglen_pulse, endpoint= False) 
 
@@ -301,8 +637,12 @@ class Pulse():
 
         ####################
         sin_envelope = amplitude * np.sin(x)
-        sin = np.sin(2*np.pi*t*FC)
-        cos = np.cos(2*np.pi*t*FC)
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*FC)
+            cos = np.cos(2*np.pi*t*FC)
+        else:
+            sin, cos = self.nco.carrier(self.nco.SCLK*FC/seglen_pulse, seglen_pulse)
+            self.nco.advance(seglen_pulse)
 
         (i) = sin*sin_envelope
         (q) = cos*sin_envelope
@@ -320,7 +660,7 @@ class Pulse():
     #=============================================================#
     #=============================================================#
 
-    def trapezoid_pulse (self, amplitude, width_slope, width_plateau, frequency):
+    def trapezoid_pulse (self, amplitude, width_slope, width_plateau, frequency, out = None, lazy = False):
         """
         This funtion prepares a trapezoid shaped pulse.
 
@@ -329,6 +669,9 @@ class Pulse():
             width_slope -  width of the slope part of the pulse in [sec]
             width_plateau - width of the plateau part of the pulse in [sec]
             frequency - of the signal in [Hz]
+            out - (optional) a pair (I, Q) of uint16/uint8 arrays with the segment length, if given the pulse
+                  is quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I, Q) pair is returned as lazy waveforms (see waveforms)
 
         OUTPUTS:
             I component of the signal
@@ -358,6 +701,23 @@ class Pulse():
         print("Trapezoid pulse segement length = {0} datapoints\n".format(tot_seglen))
         print("Trapezoid pulse segement length (in time) = {0} [ns]]".format((2*width_slope + width_plateau)*1e9))
 
+        if out is not None or lazy:
+            FC = 5 * frequency * tot_seglen * self.DUC_INTERP /2 / self.SCLK
+
+            def chunk (n, origin):
+                t = n*(1/tot_seglen)
+                envelope = amplitude * self._trapezoid_envelope(n, delta_bytes_slope, tot_seglen)
+                if self.nco is None:
+                    sin, cos = np.sin(2*np.pi*t*FC), np.cos(2*np.pi*t*FC)
+                else:
+                    sin, cos = self._nco_carrier(FC/tot_seglen, n, origin)
+                return sin*envelope, cos*envelope
+
+            if lazy:
+                return self._lazy_pulse(tot_seglen, chunk)
+
+            return self._synthesize_into(out, tot_seglen, chunk)
+
         t = np.linspace(start= 0, stop= 1, num = tot_seglen, endpoint= False) 
 
         ############## The envelope generation ##############
@@ -380,8 +740,12 @@ class Pulse():
         print('Signal frequency = {0}[Mhz]'.format(frequency / 1e6))  # the actual frequency of the sin wave in the gaussian
 
         ####################
-        sin = np.sin(2*np.pi*t*FC)
-        cos = np.cos(2*np.pi*t*FC)
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*FC)
+            cos = np.cos(2*np.pi*t*FC)
+        else:
+            sin, cos = self.nco.carrier(self.nco.SCLK*FC/tot_seglen, tot_seglen)
+            self.nco.advance(tot_seglen)
 
         (i) = sin*trapezoid_signal
         (q) = cos*trapezoid_signal
@@ -401,7 +765,7 @@ class Pulse():
     #=============================================================#
 
 
-    def gaussian_I_Q_with_IF (self, IF_frequency = float, amplitude = float, width = float, sigma = float, beta = float, I_to_Q_ratio = 1.0):
+    def gaussian_I_Q_with_IF (self, IF_frequency = float, amplitude = float, width = float, sigma = float, beta = float, I_to_Q_ratio = 1.0, out = None, lazy = False):
 
         """
         This method creates envelopes of I and Q signals to be fed to a IQ mixer.
@@ -415,6 +779,9 @@ class Pulse():
             sigma - the sigma of the gaussian [sec]
             beta - The DRAG coefficient / ALPHA   
             I_to_Q_ratio - I/Q ratio, by default '1.0', can take any float value
+            out - (optional) a pair (I_mod, Q_mod) of uint16/uint8 arrays with the segment length, if given the modulated
+                  signals are quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I_mod, Q_mod) pair is returned as lazy waveforms (see waveforms)
 
         OUTPUTS:
             I - envelope I component of the signal
@@ -437,6 +804,27 @@ class Pulse():
 
         how_many_sigmas_wide = width/sigma
 
+        if out is not None or lazy:
+            x_step = width / max(segment_length - 1, 1)
+
+            def chunk (n, origin):
+                x = -width/2 + n*x_step
+                A = amplitude * np.exp(-(x**2)/2/(sigma**2))
+                phase = (beta*x/(sigma**2)) * np.exp(-(x**2)/2/(sigma**2))
+                I = A * np.cos(phase)
+                Q = A * (1/I_to_Q_ratio) * np.sin(phase)
+                if self.nco is None:
+                    y = 2*np.pi*IF_frequency*x
+                    sin_y, cos_y = np.sin(y), np.cos(y)
+                else:
+                    sin_y, cos_y = self._nco_carrier(IF_frequency*x_step, n, origin)
+                return I*cos_y + Q*sin_y, Q*cos_y - I*sin_y
+
+            if lazy:
+                return self._lazy_pulse(segment_length, chunk)
+
+            return self._synthesize_into(out, segment_length, chunk)
+
         x = np.linspace (-width/2, width/2, segment_length)
 
         A = amplitude * np.exp(-(x**2)/2/(sigma**2)) # Amplitude
@@ -447,11 +835,16 @@ class Pulse():
 
         ################# THE IF SINGAL ########
 
-        y = np.linspace (-(np.pi*IF_frequency*width), (np.pi*IF_frequency*width), segment_length)
+        if self.nco is None:
+            y = np.linspace (-(np.pi*IF_frequency*width), (np.pi*IF_frequency*width), segment_length)
+            sin_y, cos_y = np.sin(y), np.cos(y)
+        else:
+            sin_y, cos_y = self.nco.carrier(self.nco.SCLK*IF_frequency*width/max(segment_length - 1, 1), segment_length)
+            self.nco.advance(segment_length)
         print (segment_length)
 
-        I_mod = I*np.cos(y) + Q*np.sin(y)
-        Q_mod = Q*np.cos(y) - I*np.sin(y)
+        I_mod = I*cos_y + Q*sin_y
+        Q_mod = Q*cos_y - I*sin_y
 
         if self.show_plot == True:
             plt.plot(x, I, '-', x, Q, '-')
@@ -500,6 +893,9 @@ class Pulse():
         x = np.linspace(start=1, stop=1, num=seglen, endpoint=False)
         y= DC_bias*x
 
+        if self.nco is not None:
+            self.nco.advance(seglen)
+
         if self.show_plot == True:
             plt.plot(x,y)
 
@@ -512,7 +908,7 @@ class Pulse():
 
 
     
-    def readout_pulse (self, amplitude, width_slope, width_plateau, frequency):
+    def readout_pulse (self, amplitude, width_slope, width_plateau, frequency, out = None, lazy = False):
         """
         This funtion prepares a trapezoid shaped pulse for readout.
 
@@ -521,6 +917,9 @@ class Pulse():
             width_slope -  width of the slope part of the pulse in [sec]
             width_plateau - width of the plateau part of the pulse in [sec]
             frequency - of the signal in [Hz]
+            out - (optional) a pair (I, Q) of uint16/uint8 arrays with the segment length, if given the pulse
+                  is quantized straight into them (as by helpers.digital_conv_func) and they are returned instead
+            lazy - if True nothing is computed now, the (I, Q) pair is returned as lazy waveforms (see waveforms)
 
         OUTPUTS:
             I component of the signal
@@ -547,6 +946,23 @@ class Pulse():
         print("readout pulse segement length = {0} datapoints\n".format(tot_seglen))
         print("readout pulse segement length (in time) = {0} [ns]]".format((2*width_slope + width_plateau)*1e9))
 
+        if out is not None or lazy:
+            FC = 5 * frequency * tot_seglen * self.DUC_INTERP /2 / self.SCLK
+
+            def chunk (n, origin):
+                t = n*(1/tot_seglen)
+                envelope = amplitude * self._trapezoid_envelope(n, delta_bytes_slope, tot_seglen)
+                if self.nco is None:
+                    sin, cos = np.sin(2*np.pi*t*FC), np.cos(2*np.pi*t*FC)
+                else:
+                    sin, cos = self._nco_carrier(FC/tot_seglen, n, origin)
+                return sin*envelope, cos*envelope
+
+            if lazy:
+                return self._lazy_pulse(tot_seglen, chunk)
+
+            return self._synthesize_into(out, tot_seglen, chunk)
+
         t = np.linspace(start= 0, stop= 1, num = tot_seglen, endpoint= False) 
 
         ############## The envelope generation ##############
@@ -569,8 +985,12 @@ class Pulse():
         print('Signal frequency = {0}[Mhz]'.format(frequency / 1e6))  # the actual frequency of the sin wave in the gaussian
 
         ####################
-        sin = np.sin(2*np.pi*t*FC)
-        cos = np.cos(2*np.pi*t*FC)
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*FC)
+            cos = np.cos(2*np.pi*t*FC)
+        else:
+            sin, cos = self.nco.carrier(self.nco.SCLK*FC/tot_seglen, tot_seglen)
+            self.nco.advance(tot_seglen)
 
         (i) = sin*readout_signal
         (q) = cos*readout_signal
@@ -587,4 +1007,479 @@ class Pulse():
     
     #=============================================================#
     #=============================================================#
-    #=============================================================#
\ No newline at end of file
+    #=============================================================#
+
+
+    def _stream (self, pair, block, data_type):
+        """
+        Goes through a lazy (I, Q) pair block by block, padding the end with zeros up to a multiple of 64 datapoints.
+        The same buffers are used for all the blocks.
+        """
+
+        if block <= 0 or block % 64 != 0:
+            raise ValueError("The block size should be a positive multiple of 64 datapoints.")
+
+        wave_i, wave_q = pair
+        seglen = len(wave_i)
+        padded = 64 * -(-seglen // 64)
+
+        wave_i = waveforms.Pad(wave_i, after = padded - seglen)
+        wave_q = waveforms.Pad(wave_q, after = padded - seglen)
+
+        scratch_i = np.empty(min(block, padded))
+        scratch_q = np.empty(min(block, padded))
+
+        if data_type is not None:
+            out_i = np.empty(len(scratch_i), dtype=data_type)
+            out_q = np.empty(len(scratch_q), dtype=data_type)
+            max_dac = np.iinfo(data_type).max
+
+        for start in range(0, padded, block):
+            stop = min(start + block, padded)
+            (i) = wave_i.render(start, stop, scratch_i[:stop - start])
+            (q) = wave_q.render(start, stop, scratch_q[:stop - start])
+
+            if data_type is None:
+                yield (i), (q)
+            else:
+                yield (helpers.digital_conv_into((i), out_i[:stop - start], max_dac),
+                       helpers.digital_conv_into((q), out_q[:stop - start], max_dac))
+
+
+    def trapezoid_pulse_stream (self, amplitude, width_slope, width_plateau, frequency, block = 64*1024, data_type = None):
+        """
+        Streaming version of trapezoid_pulse: the pulse is generated block by block, so the memory used
+        does not depend on the length of the pulse. Meant for uploads (helpers.write_blocks) or streaming.
+
+        INPUTS:
+            amplitude, width_slope, width_plateau, frequency - as in trapezoid_pulse
+            block - how many datapoints per block, a multiple of 64
+            data_type - None for float blocks, or np.uint16/np.uint8 for blocks already in DAC format
+
+        OUTPUTS (yields):
+            I block of the signal
+            Q block of the signal
+
+        NOTES:
+            The last block is padded with zeros up to a multiple of 64 datapoints.
+            The blocks are reused buffers, copy them if you need to keep them.
+        """
+
+        return self._stream(self.trapezoid_pulse(amplitude, width_slope, width_plateau, frequency, lazy = True), block, data_type)
+
+
+    def readout_pulse_stream (self, amplitude, width_slope, width_plateau, frequency, block = 64*1024, data_type = None):
+        """
+        Streaming version of readout_pulse: the pulse is generated block by block, so the memory used
+        does not depend on the length of the plateau. Meant for uploads (helpers.write_blocks) or streaming.
+
+        INPUTS:
+            amplitude, width_slope, width_plateau, frequency - as in readout_pulse
+            block - how many datapoints per block, a multiple of 64
+            data_type - None for float blocks, or np.uint16/np.uint8 for blocks already in DAC format
+
+        OUTPUTS (yields):
+            I block of the signal
+            Q block of the signal
+
+        NOTES:
+            The last block is padded with zeros up to a multiple of 64 datapoints.
+            The blocks are reused buffers, copy them if you need to keep them.
+        """
+
+        return self._stream(self.readout_pulse(amplitude, width_slope, width_plateau, frequency, lazy = True), block, data_type)
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def _batch_columns (self, *values):
+        """
+        Broadcasts the given sweep parameters against each other and turns them into column vectors,
+        so they can be combined with a (1, seglen) time base by broadcasting.
+
+        INPUTS:
+            values - scalars or 1D arrays of the same length (one entry per pulse)
+
+        OUTPUTS:
+            A list of arrays with shape (n_pulses, 1), in the same order as the inputs
+        """
+
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=float)) for v in values])
+
+        if arrays[0].ndim != 1:
+            raise ValueError("The sweep parameters should be scalars or 1D arrays.")
+
+        return [a.reshape(-1, 1) for a in arrays]
+
+
+    def _batch_carrier (self, cycles, seglen):
+        """
+        The sin and cos carriers of a batch from the NCO. The pulses of a sweep are alternatives that take the same place
+        in the time base, so all of them start at the current NCO position, and the NCO is moved past one segment.
+
+        INPUTS:
+            cycles - the carrier cycles per datapoint of every pulse, shape (n_pulses, 1)
+            seglen - the segment length in datapoints
+
+        OUTPUTS:
+            sin, cos - the carriers, shape (n_pulses, seglen)
+        """
+
+        n = np.arange(seglen)
+        origin = self.nco.position
+        sin = np.empty((cycles.shape[0], seglen))
+        cos = np.empty((cycles.shape[0], seglen))
+
+        for k in range(cycles.shape[0]):
+            sin[k], cos[k] = self._nco_carrier(float(cycles[k, 0]), n, origin)
+
+        self.nco.advance(seglen)
+
+        return sin, cos
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def gaussian_pulse_batch (self, amplitudes, sigmas, width_over_sigma, frequencies):
+        """
+        This method prepares a whole sweep of gaussian pulses at once (see gaussian_pulse).
+        All the pulses share the segment length of the widest one, so the output is a single 2D array.
+        A pulse with the widest sigma is identical to the one given by gaussian_pulse.
+
+        INPUTS:
+            amplitudes - the amplitude scalers of the signals, take values [0 to 1] (scalar or 1D array)
+            sigmas - the sigmas of the gaussians in [sec] (scalar or 1D array)
+            width_over_sigma - how many (of the widest) sigmas wide is the segment, RECOMENDED VALUE == 4 or 5
+            frequencies - of the signals in [Hz] (scalar or 1D array)
+
+        OUTPUTS:
+            I - components of the signals, shape (n_pulses, seglen)
+            Q - components of the signals, shape (n_pulses, seglen)
+            Magn - the magnitudes of the signals, shape (n_pulses, seglen)
+            Gaussian - the envelope functions, shape (n_pulses, seglen)
+        """
+
+        amplitude, sigma, frequency = self._batch_columns(amplitudes, sigmas, frequencies)
+        n_pulses = amplitude.shape[0]
+
+        frequency = frequency / self.DUC_INTERP
+
+        period = 1/frequency
+        delta_t = 1/self.SCLK ### how much time between each two sequential signal points
+        sigma_numerical = sigma/delta_t  ### how many datapoints within a sigma
+
+        seglen_gauss = int(width_over_sigma*sigma_numerical.max())
+
+    ################# WARNINGS AND CHECKS #######################
+
+        if self.DUC_INTERP != 1:
+            print ('Attention the DUC Interpreter has a value different then 1, mainly {0}. This will divide the frequency by {0}'.format(self.DUC_INTERP))
+
+        if np.any(5*period > sigma):
+            print ("\n!WARNING! Sigma is comparable to the period of the oscillation for some of the pulses\n")
+
+        seglen_gauss, normalization_factor = helpers.formatter(seglen_gauss)
+
+        print("Batch of {0} gaussian pulses, segment length = {1} datapoints".format(n_pulses, seglen_gauss))
+
+    ###########################################################
+
+        t = np.linspace(-1, 1, seglen_gauss, endpoint=False)[np.newaxis, :]
+
+        ss = sigma_numerical / seglen_gauss
+
+        GAUS_FC = frequency * seglen_gauss * self.DUC_INTERP /2 / self.SCLK
+
+        ####################
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*GAUS_FC)
+            cos = np.cos(2*np.pi*t*GAUS_FC)
+        else:
+            sin, cos = self._batch_carrier(2*GAUS_FC/seglen_gauss, seglen_gauss)
+        gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+        (i) = sin*gaussian
+        (q) = cos*gaussian
+        magn = (i) + (q)
+        ####################
+
+        if self.show_plot == True:
+            plt.plot(t[0], (i)[0], '-', t[0], (q)[0], '-')
+            plt.legend(['I','Q'])
+
+        return (i), (q), magn, gaussian
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def gaussian_drag_pulse_batch (self, amplitudes, sigmas, width_over_sigma, betas, frequencies):
+        """
+        This method prepares a whole sweep of gaussian pulses with DRAG at once (see gaussian_drag_pulse).
+        All the pulses share the segment length of the widest one, so the output is a single 2D array.
+
+        INPUTS:
+            amplitudes - the amplitude scalers of the signals, take values [0 to 1] (scalar or 1D array)
+            sigmas - the sigmas of the gaussians in [sec] (scalar or 1D array)
+            width_over_sigma - how many (of the widest) sigmas wide is the segment, RECOMENDED VALUE == 4 or 5
+            betas - the DRAG coefficients (scalar or 1D array)
+            frequencies - of the signals in [Hz] (scalar or 1D array)
+
+        OUTPUTS:
+            I - components of the signals, shape (n_pulses, seglen)
+            Q - components of the signals, shape (n_pulses, seglen)
+            Magn - the magnitudes of the signals, shape (n_pulses, seglen)
+            Gaussian - the envelope functions, shape (n_pulses, seglen)
+        """
+
+        amplitude, sigma, beta, frequency = self._batch_columns(amplitudes, sigmas, betas, frequencies)
+        n_pulses = amplitude.shape[0]
+
+        frequency = frequency / self.DUC_INTERP
+
+        period = 1/frequency
+        delta_t = 1/self.SCLK ### how much time between each two sequential signal points
+        sigma_numerical = sigma/delta_t  ### how many datapoints within a sigma
+
+        seglen_gauss = int(width_over_sigma*sigma_numerical.max())
+
+    ################# WARNINGS AND CHECKS #######################
+
+        if self.DUC_INTERP != 1:
+            print ('Attention the DUC Interpreter has a value different then 1, mainly {0}. This will divide the frequency by {0}'.format(self.DUC_INTERP))
+
+        if np.any(5*period > sigma):
+            print ("\n!WARNING! Sigma is comparable to the period of the oscillation for some of the pulses\n")
+
+        seglen_gauss, normalization_factor = helpers.formatter(seglen_gauss)
+
+        print("Batch of {0} DRAG pulses, segment length = {1} datapoints".format(n_pulses, seglen_gauss))
+
+    ###########################################################
+
+        t = np.linspace(-1, 1, seglen_gauss, endpoint=False)[np.newaxis, :]
+
+        ss = sigma_numerical / seglen_gauss
+
+        GAUS_FC = frequency * seglen_gauss * self.DUC_INTERP /2 / self.SCLK
+
+        ####################
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*GAUS_FC)
+            cos = np.cos(2*np.pi*t*GAUS_FC)
+        else:
+            sin, cos = self._batch_carrier(2*GAUS_FC/seglen_gauss, seglen_gauss)
+        gaussian = amplitude * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+        gaussian_dragged = amplitude * (1 - beta*t/ss*2) * (1/ss/np.sqrt(2*np.pi)/2) * np.exp(-(t**2)/2/(ss**2)) / normalization_factor
+        (i) = sin*gaussian
+        (q) = cos*gaussian_dragged
+        magn = (i) + (q)
+        ####################
+
+        if self.show_plot == True:
+            plt.plot(t[0], (i)[0], '-', t[0], (q)[0], '-')
+            plt.legend(['I','Q'])
+
+        return (i), (q), magn, gaussian
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def sin_pulse_batch (self, amplitudes, width, frequencies):
+        """
+        This method prepares a whole sweep of sin shaped pulses at once (see sin_pulse).
+
+        INPUTS:
+            amplitudes - the amplitude scalers of the signals, take values [0 to 1] (scalar or 1D array)
+            width - of the pulses [sec], the same for all of them
+            frequencies - of the signals in [Hz] (scalar or 1D array)
+
+        OUTPUTS:
+            I components of the signals, shape (n_pulses, seglen)
+            Q components of the signals, shape (n_pulses, seglen)
+            Sin_envelope - the envelopes of the pulses, shape (n_pulses, seglen)
+        """
+
+        amplitude, frequency = self._batch_columns(amplitudes, frequencies)
+        n_pulses = amplitude.shape[0]
+
+        if self.DUC_INTERP != 1:
+            print ('====Attention the DUC Interpreter has a value different then 1!====')
+
+        frequency = frequency / self.DUC_INTERP
+
+        delta_t = 1/self.SCLK ### how much time between each two sequential signal points
+
+        seglen_pulse = int(width / delta_t)
+        seglen_pulse, normalization_factor = helpers.formatter(seglen_pulse)
+
+        print("Batch of {0} sine pulses, segment length = {1} datapoints".format(n_pulses, seglen_pulse))
+
+        t = np.linspace(start= 0, stop= 1, num= seglen_pulse, endpoint= False)[np.newaxis, :]
+        x = np.linspace(start= 0, stop= np.pi, num= seglen_pulse, endpoint= False)[np.newaxis, :]
+
+        FC = 5 * frequency * seglen_pulse * self.DUC_INTERP /2 / self.SCLK
+
+        ####################
+        sin_envelope = amplitude * np.sin(x)
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*FC)
+            cos = np.cos(2*np.pi*t*FC)
+        else:
+            sin, cos = self._batch_carrier(FC/seglen_pulse, seglen_pulse)
+
+        (i) = sin*sin_envelope
+        (q) = cos*sin_envelope
+        ####################
+
+        if self.show_plot == True:
+            plt.plot(t[0], (i)[0], '-', t[0], (q)[0], '-')
+            plt.legend(['I','Q'])
+
+        return (i), (q), sin_envelope
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def trapezoid_pulse_batch (self, amplitudes, width_slope, width_plateau, frequencies):
+        """
+        This method prepares a whole sweep of trapezoid shaped pulses at once (see trapezoid_pulse).
+
+        INPUTS:
+            amplitudes - the amplitude scalers of the signals, take values [0 to 1] (scalar or 1D array)
+            width_slope -  width of the slope part of the pulses in [sec], the same for all of them
+            width_plateau - width of the plateau part of the pulses in [sec], the same for all of them
+            frequencies - of the signals in [Hz] (scalar or 1D array)
+
+        OUTPUTS:
+            I components of the signals, shape (n_pulses, seglen)
+            Q components of the signals, shape (n_pulses, seglen)
+            Trapezoid_signal - the envelopes of the pulses, shape (n_pulses, seglen)
+        """
+
+        amplitude, frequency = self._batch_columns(amplitudes, frequencies)
+        n_pulses = amplitude.shape[0]
+
+        if self.DUC_INTERP != 1:
+            print ('====Attention the DUC Interpreter has a value different then 1!====')
+
+        frequency = frequency / self.DUC_INTERP
+
+        delta_bytes_slope = int(helpers.formatter(width_slope*self.SCLK)[0])
+        delta_bytes_plateau = int(helpers.formatter(width_plateau*self.SCLK)[0])
+
+        tot_seglen = 2*delta_bytes_slope + delta_bytes_plateau
+
+        print("Batch of {0} trapezoid pulses, segment length = {1} datapoints".format(n_pulses, tot_seglen))
+
+        t = np.linspace(start= 0, stop= 1, num = tot_seglen, endpoint= False)[np.newaxis, :]
+
+        ############## The envelope generation ##############
+        upward_slope = np.sin (np.linspace (0, np.pi/2, delta_bytes_slope))
+        downward_slope = np.flip (upward_slope)
+        plateau = np.linspace (1, 1, delta_bytes_plateau)
+
+        trapezoid_signal = np.concatenate ((upward_slope, plateau, downward_slope), axis = 0)
+        trapezoid_signal = amplitude * trapezoid_signal[np.newaxis, :]
+
+        #########################################
+
+        FC = 5 * frequency * tot_seglen * self.DUC_INTERP /2 / self.SCLK
+
+        ####################
+        if self.nco is None:
+            sin = np.sin(2*np.pi*t*FC)
+            cos = np.cos(2*np.pi*t*FC)
+        else:
+            sin, cos = self._batch_carrier(FC/tot_seglen, tot_seglen)
+
+        (i) = sin*trapezoid_signal
+        (q) = cos*trapezoid_signal
+        ####################
+
+        if self.show_plot == True:
+            plt.plot(t[0], (i)[0], '-', t[0], (q)[0], '-')
+            plt.legend(['I','Q'])
+
+        return (i), (q), trapezoid_signal
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+    def gaussian_I_Q_with_IF_batch (self, IF_frequencies, amplitudes, width, sigmas, betas, I_to_Q_ratio = 1.0):
+        """
+        This method prepares a whole sweep of DRAG envelopes for an IQ mixer at once (see gaussian_I_Q_with_IF).
+
+        INPUTS:
+            IF_frequencies - the IF frequencies in [Hz] (scalar or 1D array)
+            amplitudes - the amplitude scalers of the signals, take values [0 to 1] (scalar or 1D array)
+            width -  width of the gaussians in [sec], the same for all of them
+            sigmas - the sigmas of the gaussians [sec] (scalar or 1D array)
+            betas - The DRAG coefficients / ALPHA (scalar or 1D array)
+            I_to_Q_ratio - I/Q ratio, by default '1.0', can take any float value
+
+        OUTPUTS:
+            I - envelope I components of the signals, shape (n_pulses, seglen)
+            Q - envelope Q components of the signals, shape (n_pulses, seglen)
+            I_mod - modulated I components of the signals, shape (n_pulses, seglen)
+            Q_mod - modulated Q components of the signals, shape (n_pulses, seglen)
+        """
+
+        IF_frequency, amplitude, sigma, beta = self._batch_columns(IF_frequencies, amplitudes, sigmas, betas)
+        n_pulses = amplitude.shape[0]
+
+        delta_t = self.DUC_INTERP/self.SCLK # how much time is there b/w 2 consecutive datapoints
+
+        ################ THE ENVELOPE ############
+
+        segment_length = int(width / delta_t) # how many dataponts we would need to express the signal
+
+        print("Batch of {0} IQ DRAG pulses, segment length = {1} datapoints".format(n_pulses, segment_length))
+
+        x = np.linspace (-width/2, width/2, segment_length)[np.newaxis, :]
+        unit = np.linspace (-1, 1, segment_length)[np.newaxis, :]
+
+        A = amplitude * np.exp(-(x**2)/2/(sigma**2)) # Amplitude
+        phase = (beta*x/(sigma**2)) * np.exp(-(x**2)/2/(sigma**2)) # Phase
+
+        I = A * np.cos(phase)
+        Q = A * (1/I_to_Q_ratio) * np.sin(phase)
+
+        ################# THE IF SINGAL ########
+
+        if self.nco is None:
+            y = (np.pi*IF_frequency*width) * unit
+            cos_y = np.cos(y)
+            sin_y = np.sin(y)
+        else:
+            sin_y, cos_y = self._batch_carrier(IF_frequency*width/max(segment_length - 1, 1), segment_length)
+
+        I_mod = I*cos_y + Q*sin_y
+        Q_mod = Q*cos_y - I*sin_y
+
+        if self.show_plot == True:
+            plt.plot(x[0], I[0], '-', x[0], Q[0], '-')
+            plt.legend(['I envelope','Q envelope'])
+
+        return I, Q, I_mod, Q_mod
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
@@ -4,6 +4,7 @@ from teproteus import TEProteusInst as TepInst
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+import asyncio
 
 
 def digitizer_setup(inst, DIG_SCLK, DDC_NCO, time_delay):
@@ -168,6 +169,46 @@ def capturer(inst):
     #=============================================================#
 
 
+async def capturer_async(ainst, timeout = 10.0):
+    """    
+    The same as capturer, for the asyncio front-end (tep_async.AsyncProteus): while waiting for the frames
+    the event loop is free, so other experiments or waveform preparation can run in between.
+    Use as: await readers.capturer_async(ainst)
+    
+    INUT:
+        ainst - the AsyncProteus of the proteus instance
+        timeout - how long to wait for the frames [sec]
+    
+    OUTPUT:
+        The last frame status response
+        
+    """
+
+    # Stop the digitizer's capturing machine (to be on the safe side)
+    await ainst.send_scpi_cmd(':DIG:INIT OFF')
+    await asyncio.sleep(0.1)
+
+    # Start the digitizer's capturing machine ###################### START CAPTURE
+    await ainst.send_scpi_cmd(':DIG:INIT ON')
+
+    try:
+        start = time.monotonic()
+        resp = await ainst.wait_for_frames(timeout = timeout)
+        print('Response:',resp, 'Time:',time.monotonic() - start)
+    finally:
+        # Stop the digitizer's capturing machine (to be on the safe side) ################# STOP CAPTURE
+        await ainst.send_scpi_cmd(':DIG:INIT OFF')
+
+    resp_err = await ainst.send_scpi_query(':SYST:ERR?')
+    print(resp_err)
+    
+    return resp
+
+#=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
 def IQ_data_extractor(inst, channel = int, numframes = int, framelen = int):
     
     """    
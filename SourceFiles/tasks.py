@@ -1,10 +1,15 @@
 import os
+import math
 from teproteus import TEProteusAdmin as TepAdmin
 from teproteus import TEProteusInst as TepInst
+from tep_task_table import TaskTableRow, TaskIdleWav
 import numpy as np
+import helpers
 
 """This library stores all the task tables for various qunatum pulse sequences."""
 
+MAX_TASK_LOOPS = 2**20 - 1  # the most loops one task-table row can play
+
 class Task():
     
     def __init__(self, inst):
@@ -32,48 +37,50 @@ class Task():
         cmd = ':INST:CHAN {0}'.format(channel)
         self.inst.send_scpi_cmd(cmd )
 
-        cmd = ':TASK:COMP:LENG {0}'.format(tasklen)
-        self.inst.send_scpi_cmd(cmd )
+        # the task commands are sent joined, in a few transactions (see tep_scpi_batch)
+        with self.inst.batch():
+            cmd = ':TASK:COMP:LENG {0}'.format(tasklen)
+            self.inst.send_scpi_cmd(cmd )
 
 
-        for i in range(tasklen):
-            curr_task = i + 1
-            segnb = i + 1
-            print("Current task:",curr_task)
+            for i in range(tasklen):
+                curr_task = i + 1
+                segnb = i + 1
+                print("Current task:",curr_task)
 
-            cmd = ':TASK:COMP:SEL {0}'.format(curr_task)
-            self.inst.send_scpi_cmd(cmd)
-            cmd = ':TASK:COMP:DTRigger ON'
-            self.inst.send_scpi_cmd(cmd)
+                cmd = ':TASK:COMP:SEL {0}'.format(curr_task)
+                self.inst.send_scpi_cmd(cmd)
+                cmd = ':TASK:COMP:DTRigger ON'
+                self.inst.send_scpi_cmd(cmd)
+
+                # conditional statements to create closed loop task
+                if curr_task == 1: 
+                    cmd = ':TASK:COMP:ENAB CPU'
 
-            # conditional statements to create closed loop task
-            if curr_task == 1: 
-                cmd = ':TASK:COMP:ENAB CPU'
+                if curr_task==tasklen:
+                    cmd = ':TASK:COMP:NEXT1 {0}'.format(1)
+                    self.inst.send_scpi_cmd(cmd)
+                    print("Next task will be task:",1)
+                else:
+                    cmd = ':TASK:COMP:NEXT1 {0}'.format(curr_task+1)
+                    self.inst.send_scpi_cmd(cmd)
+                    print("Next task will be task:",curr_task+1)
 
-            if curr_task==tasklen:
-                cmd = ':TASK:COMP:NEXT1 {0}'.format(1)
+                cmd = ':TASK:COMP:TYPE SING'
                 self.inst.send_scpi_cmd(cmd)
-                print("Next task will be task:",1)
-            else:
-                cmd = ':TASK:COMP:NEXT1 {0}'.format(curr_task+1)
+
+                # define the number of loops for the specific task
+                cmd = ':TASK:COMP:LOOP {0}'.format(1)
                 self.inst.send_scpi_cmd(cmd)
-                print("Next task will be task:",curr_task+1)
 
-            cmd = ':TASK:COMP:TYPE SING'
-            self.inst.send_scpi_cmd(cmd)
+                # name the segment of memory to take the signal to be tasked with the aformentioned parameters from
+                cmd = ':TASK:COMP:SEGM {0}'.format(segnb)
+                self.inst.send_scpi_cmd(cmd)
 
-            # define the number of loops for the specific task
-            cmd = ':TASK:COMP:LOOP {0}'.format(1)
-            self.inst.send_scpi_cmd(cmd)
 
-            # name the segment of memory to take the signal to be tasked with the aformentioned parameters from
-            cmd = ':TASK:COMP:SEGM {0}'.format(segnb)
+            # write task to the machine
+            cmd = ':TASK:COMP:WRIT'
             self.inst.send_scpi_cmd(cmd)
-
-
-        # write task to the machine
-        cmd = ':TASK:COMP:WRIT'
-        self.inst.send_scpi_cmd(cmd)
         print('Downloading Task table to channel {0}'.format(channel))
 
         # point to the channel
@@ -331,3 +338,390 @@ class Task():
         return None
 
 
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+    def compressed_sequence (self, channel, wave, first_segment = 1, **options):
+
+        """
+        Downloads a long waveform with its constant (or periodic) stretches compressed into task-table loops (see compress_constant_runs),
+        and the task table that plays it back. Instead of e.g. a 10 ms blank written point by point, one 2048 points segment is looped.
+
+        INPUTS:
+            channel - channel number
+            wave - the binary array (uint16 or uint8) of the whole sequence, a multiple of 64 datapoints
+            first_segment - the segment number of the first segment used, the next ones follow it
+            options - passed to compress_constant_runs (const_len, min_run, period, tick_points)
+
+        OUTPUTS:
+            segments - the list of the segments downloaded (numbered from first_segment)
+            rows - the list of task-table rows (TaskTableRow) written
+        """
+
+        segments, rows = compress_constant_runs(wave, first_segment = first_segment, **options)
+
+        for i in range(len(segments)):
+            helpers.download_func(self.inst, segments[i], channel, first_segment + i)
+
+        self.write_task_rows(channel, rows)
+
+        return segments, rows
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+    def packed_sequence (self, channel, items, first_segment = 1, **options):
+
+        """
+        Downloads a sequence of short pulses and blanks packed into shared segments (see pack_pulses),
+        and the task table that plays it back.
+
+        INPUTS:
+            channel - channel number
+            items - list of the sequence in playing order: binary arrays for the pulses and integers for the blanks (in datapoints)
+            first_segment - the segment number of the first segment used, the next ones follow it
+            options - passed to pack_pulses (max_dac, data_type, const_len, min_run, tick_points)
+
+        OUTPUTS:
+            segments - the list of the segments downloaded (numbered from first_segment)
+            rows - the list of task-table rows (TaskTableRow) written
+        """
+
+        segments, rows = pack_pulses(items, first_segment = first_segment, **options)
+
+        for i in range(len(segments)):
+            helpers.download_func(self.inst, segments[i], channel, first_segment + i)
+
+        self.write_task_rows(channel, rows)
+
+        return segments, rows
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+    def write_task_rows (self, channel, rows):
+
+        """
+        Writes a task table given as a list of single tasks (TaskTableRow, from tep_task_table) to the channel.
+
+        INPUTS:
+            channel - channel number
+            rows - the list of TaskTableRow, the first one is task 1
+
+        OUTPUTS:
+            None
+        """
+
+        self.inst.send_scpi_cmd(':INST:CHAN {0}'.format(channel))
+
+        # the task commands are sent joined, in a few transactions (see tep_scpi_batch)
+        with self.inst.batch():
+            self.inst.send_scpi_cmd(':TASK:COMP:LENG {0}'.format(len(rows)))
+
+            for i in range(len(rows)):
+                row = rows[i]
+
+                self.inst.send_scpi_cmd(':TASK:COMP:SEL {0}'.format(i + 1))
+                self.inst.send_scpi_cmd(':TASK:COMP:TYPE SING')
+                self.inst.send_scpi_cmd(':TASK:COMP:SEGM {0}'.format(row.seg_num))
+                self.inst.send_scpi_cmd(':TASK:COMP:LOOP {0}'.format(row.task_loops))
+                self.inst.send_scpi_cmd(':TASK:COMP:NEXT1 {0}'.format(row.next_task1))
+
+                # the idle DC level is played during the delay before the next task
+                if row.delay_ticks:
+                    self.inst.send_scpi_cmd(':TASK:COMP:IDLE {0}'.format(row.idle_wave))
+                    self.inst.send_scpi_cmd(':TASK:COMP:IDLE:LEV {0}'.format(row.idle_dc_level))
+                    self.inst.send_scpi_cmd(':TASK:COMP:DEL {0}'.format(row.delay_ticks))
+
+                if row.trig_digitizer:
+                    self.inst.send_scpi_cmd(':TASK:COMP:DTR ON')
+
+            # write task to the machine
+            self.inst.send_scpi_cmd(':TASK:COMP:WRIT')
+        print('Downloading Task table to channel {0}'.format(channel))
+
+        # see if any errors came up
+        resp = self.inst.send_scpi_query(':SYST:ERR?')
+        print(resp)
+
+        return None
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+def compress_constant_runs (wave, const_len = 2048, min_run = None, period = 1, first_segment = 1, tick_points = None):
+
+    """
+    Finds the long constant stretches of a waveform (blanks, plateaus) and rewrites them as one short segment played in a loop,
+    so that they do not take instrument memory and upload time point by point.
+    With period > 1 the stretches that repeat every period datapoints are found instead, e.g. period = 2 for the blanks of I/Q interleaved data.
+
+    INPUTS:
+        wave - the binary array (uint16 or uint8) of the whole sequence, a multiple of 64 datapoints
+        const_len - the length of the looped segment, a multiple of 64 (and of period) and at least 2048
+        min_run - the shortest stretch worth compressing, by default 2 * const_len
+        period - the stretches searched for repeat every period datapoints
+        first_segment - the segment number given to the first segment
+        tick_points - (optional) how many datapoints one task delay tick lasts.
+                      If given (and period = 1, 16-bit data), the leftover of a stretch that does not fill a whole loop
+                      is played as a delay with the idle DC level at the stretch's value, instead of staying in the data.
+
+    OUTPUTS:
+        segments - list of the arrays to download, the first one to first_segment and so on (views into wave, not copies)
+        rows - list of the task-table rows (TaskTableRow) that play the sequence, looping back to the first one
+    """
+
+    wave = np.asarray(wave)
+    seglen = len(wave)
+
+    if const_len % period != 0:
+        raise ValueError("const_len should be a multiple of the period.")
+    if seglen % 64 != 0:
+        raise ValueError("The waveform should be a multiple of 64 datapoints.")
+
+    # the stretches [start, stop) where wave[i] == wave[i - period]
+    same = np.concatenate(([0], wave[period:] == wave[:-period], [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(same))
+    starts, stops = edges[0::2], edges[1::2] + period
+
+    pieces = _plan_pieces(seglen, starts, stops, const_len, min_run, tick_points if period == 1 and wave.dtype == np.uint16 else None)
+
+    segments, rows = _pieces_to_tasks(pieces, lambda a, b: wave[a:b], first_segment)
+
+    stored = sum(len(s) for s in segments)
+    print('{0} datapoints compressed into {1} datapoints: {2} segments, {3} tasks.'.format(seglen, stored, len(segments), len(rows)))
+
+    return segments, rows
+
+
+
+def pack_pulses (items, max_dac = 65535, data_type = np.uint16, const_len = 2048, min_run = None, first_segment = 1, tick_points = None):
+
+    """
+    Plans the segments and the task table of a sequence of (short) pulses and blanks, without building the whole sequence.
+    Instead of giving every pulse its own segment of at least 2048 datapoints (see helpers.formatter),
+    the pulses that follow each other closely share a segment, at any offset, and the long blanks between them become
+    a looped blank segment. Only the shared segments are ever built, so the upload is about the size of the pulses themselves.
+
+    INPUTS:
+        items - list of the sequence in playing order: binary arrays (uint16 or uint8) for the pulses, of any length,
+                and integers for the blanks, in datapoints at the zero level of the DAC
+        max_dac, data_type - the DAC range and data type (from connection_func)
+        const_len, min_run, first_segment, tick_points - as in compress_constant_runs
+
+    OUTPUTS:
+        segments - list of the arrays to download, the first one to first_segment and so on
+        rows - list of the task-table rows (TaskTableRow) that play the sequence, looping back to the first one
+
+    NOTES:
+        The end of the sequence is filled with blank up to a multiple of 64 datapoints (and at least 2048).
+        Pieces of the sequence that come out the same (e.g. a repeated gate and its blank) share one segment.
+    """
+
+    zero = max_dac // 2  # the DAC value of 0.0, as in helpers.digital_conv_func
+
+    pulses = []  # (offset, array)
+    blanks = []  # [start, stop)
+    pos = 0
+
+    for item in items:
+        if isinstance(item, (int, np.integer)):
+            if blanks and blanks[-1][1] == pos:
+                blanks[-1][1] += int(item)
+            elif item > 0:
+                blanks.append([pos, pos + int(item)])
+            pos += int(item)
+        else:
+            pulses.append((pos, np.asarray(item, dtype = data_type)))
+            pos += len(item)
+
+    seglen = max(-(-pos // 64) * 64, 64 * 32)
+    if seglen > pos:
+        if blanks and blanks[-1][1] == pos:
+            blanks[-1][1] = seglen
+        else:
+            blanks.append([pos, seglen])
+
+    offsets = np.array([offset for offset, pulse in pulses] + [seglen])
+
+    def data (a, b):
+        out = np.full(b - a, zero, dtype = data_type)
+        for i in range(max(np.searchsorted(offsets, a, side = 'right') - 1, 0), np.searchsorted(offsets, b)):
+            offset, pulse = pulses[i]
+            lo, hi = max(a, offset), min(b, offset + len(pulse))
+            if lo < hi:
+                out[lo - a:hi - a] = pulse[lo - offset:hi - offset]
+        return out
+
+    starts, stops = np.array(blanks, dtype = np.int64).reshape(-1, 2).T
+    pieces = _plan_pieces(seglen, starts, stops, const_len, min_run, tick_points if np.dtype(data_type) == np.uint16 else None)
+
+    segments, rows = _pieces_to_tasks(pieces, data, first_segment)
+
+    stored = sum(len(s) for s in segments)
+    print('{0} pulses ({1} datapoints of sequence) packed into {2} datapoints: {3} segments, {4} tasks.'.format(
+        len(pulses), seglen, stored, len(segments), len(rows)))
+
+    return segments, rows
+
+
+
+def _plan_pieces (seglen, starts, stops, const_len, min_run, tick_points):
+
+    """
+    Cuts a sequence of seglen datapoints into data pieces and looped pieces, given its constant stretches [starts, stops).
+    Every data piece is a multiple of 64 and at least 2048 datapoints. Returns the list of [start, stop, loops, ticks],
+    where loops = 0 for the data pieces and a looped piece plays [start, stop) loops times followed by a delay of ticks.
+    """
+
+    min_seglen = 64 * 32  # the shortest segment, 64 * (32 + n)
+
+    if min_run is None:
+        min_run = 2 * const_len
+
+    if const_len % 64 != 0 or const_len < min_seglen:
+        raise ValueError("const_len should be a multiple of 64 and at least {0} datapoints.".format(min_seglen))
+
+    if tick_points is not None:
+        tick_unit = tick_points * 64 // math.gcd(tick_points, 64)  # delays that keep the segments a multiple of 64
+        max_ticks = 65535 // (tick_unit // tick_points) * (tick_unit // tick_points)
+
+    pieces = []  # [start, stop, loops, ticks], loops = 0 for the plain data pieces
+    pos = 0
+
+    for start, stop in zip(starts, stops):
+        if stop - start < min_run:
+            continue
+
+        # the data before the stretch has to be a whole segment on its own
+        a = pos + -(-(max(start, pos) - pos) // 64) * 64
+        if 0 < a - pos < min_seglen:
+            a = pos + min_seglen
+
+        loops = max(stop - a, 0) // const_len
+        ticks = 0
+        if tick_points is not None and loops:
+            ticks = min((stop - a - loops * const_len) // tick_unit * (tick_unit // tick_points), max_ticks)
+        run = loops * const_len + (ticks * tick_points if ticks else 0)
+
+        if run < min_run:
+            continue
+
+        if a > pos:
+            pieces.append([pos, a, 0, 0])
+        pieces.append([a, a + const_len, loops, ticks])
+        pos = a + run
+
+    # the data after the last stretch has to be a whole segment too, so give some of the loops back to it
+    while 0 < seglen - pos < min_seglen and pieces:
+        a, b, loops, ticks = pieces[-1]
+        pos = a + loops * const_len
+        loops -= max(-(-(min_seglen - (seglen - pos)) // const_len), 0)
+
+        if loops * const_len >= min_run:
+            pieces[-1][2:] = [loops, 0]
+            pos = a + loops * const_len
+        else:
+            pieces.pop()
+            pos = a
+            if pieces and pieces[-1][2] == 0:
+                pos = pieces.pop()[0]
+
+    if pos < seglen:
+        pieces.append([pos, seglen, 0, 0])
+
+    return pieces
+
+
+
+def _pieces_to_tasks (pieces, data_of, first_segment):
+
+    """
+    Makes the segments and the task-table rows of the pieces from _plan_pieces; data_of(start, stop) gives the data of a piece.
+    The pieces with the same content are downloaded only once (found by a hash of the content, then compared).
+    A piece looped more than MAX_TASK_LOOPS times is played by several rows of the same segment.
+    """
+
+    segments = []
+    rows = []
+    numbers = {}  # content hash -> list of segment indices
+
+    for a, b, loops, ticks in pieces:
+        data = data_of(a, b)
+
+        candidates = numbers.setdefault(helpers.SegmentRegistry.content_hash(data), [])
+        for index in candidates:
+            if np.array_equal(segments[index], data):
+                break
+        else:
+            index = len(segments)
+            candidates.append(index)
+            segments.append(data)
+        seg_num = first_segment + index
+
+        loops = max(loops, 1)
+        while loops > MAX_TASK_LOOPS:
+            rows.append(TaskTableRow(
+                seg_num = seg_num,
+                next_task1 = len(rows) + 2,
+                task_loops = MAX_TASK_LOOPS,
+                idle_wave = TaskIdleWav.DC))
+            loops -= MAX_TASK_LOOPS
+
+        rows.append(TaskTableRow(
+            seg_num = seg_num,
+            next_task1 = len(rows) + 2,
+            task_loops = loops,
+            idle_wave = TaskIdleWav.DC,
+            idle_dc_level = int(data[0]) if ticks else 0,
+            delay_ticks = ticks))
+
+    rows[-1].next_task1 = 1  # this loops the tasktable
+    rows[0].trig_digitizer = True
+
+    return segments, rows
+
+
+
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+
+def parallel_task_rows (multi, jobs):
+
+    """
+    Writes task-tables to several modules at once (tep_multi.MultiSlotSession), every module on its own thread.
+
+    INPUT:
+        multi - the MultiSlotSession of the modules
+        jobs - dictionary of slot id to a list of (channel, rows), the rows as for Task.write_task_rows
+
+    OUTPUT:
+        The timings (see tep_multi.MultiSlotSession.map): seconds per slot, the wall time and the speedup
+    """
+
+    def write (inst, tables):
+        for channel, rows in tables:
+            Task(inst).write_task_rows(channel, rows)
+
+    results, timings = multi.map(write, dict((sid, (tables,)) for sid, tables in jobs.items()))
+
+    print('Task-tables of {0} modules written in {1:.3f} s (x{2:.1f} over one at a time)'.format(len(jobs), timings['wall'], timings['speedup']))
+
+    return timings
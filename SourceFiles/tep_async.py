@@ -0,0 +1,164 @@
+'''
+tep_async - asyncio front-end for Proteus instruments.
+
+The class :class:`tep_async.AsyncProteus` wraps an instrument
+(:class:`teproteus.TEProteusInst` or :class:`tevisainst.TEVisaInst`)
+and runs all its (blocking) driver calls on a single dedicated thread,
+so that the asyncio event-loop stays free: waveform preparation, uploads
+and digitizer polling of several experiments can be interleaved.
+
+The driver calls of one instrument are executed one at a time, in the order
+they were awaited (the driver is not thread-safe).
+
+**Example of use**
+
+.. code-block:: python
+
+    import asyncio
+    from tep_async import AsyncProteus
+
+    async def experiment(ainst):
+        await ainst.send_scpi_cmd(':DIG:INIT ON')
+        resp = await ainst.wait_for_frames(timeout=10)
+        await ainst.send_scpi_cmd(':DIG:INIT OFF')
+
+    async def main(inst):
+        async with AsyncProteus(inst) as ainst:
+            await asyncio.gather(experiment(ainst), other_work())
+'''
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['AsyncProteus', 'frames_done']
+
+
+def frames_done(resp):
+    '''
+    Checks the response of `:DIG:ACQuire:FRAM:STAT?` for the
+    "all frames captured" flag (the test used by `readers.capturer`).
+
+    :param resp: the response string.
+    :returns: True if all the frames were captured.
+    '''
+    return resp[6:] == '1'
+
+
+class AsyncProteus(object):
+    '''
+    Awaitable wrapper of a Proteus instrument.
+
+    Every driver call runs on the wrapper's own executor thread.
+    '''
+
+    def __init__(self, inst, loop=None):
+        '''
+        Constructor.
+
+        :param inst: the (open) instrument.
+        :param loop: the event-loop (optional, the running loop by default).
+        '''
+        self._inst = inst
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='proteus')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        del exc_type, exc_value, traceback
+        await self.aclose()
+
+    @property
+    def inst(self):
+        '''The wrapped instrument (do not call it from other threads).'''
+        return self._inst
+
+    def close(self):
+        '''Stops the executor thread (after the calls already submitted).'''
+        self._executor.shutdown(wait=True)
+
+    async def aclose(self):
+        '''Stops the executor thread, waiting for the calls already
+        submitted on another thread (the event-loop is not blocked).'''
+        loop = self._loop or asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Runs any blocking function on the executor thread.
+
+        Useful for driver calls that have no awaitable method here,
+        or for helpers that take the instrument, e.g.
+        `await ainst.run(helpers.download_func, ainst.inst, wave, 1, 1)`.
+
+        :param func: the function.
+        :returns: the function's return value.
+        '''
+        loop = self._loop or asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def send_scpi_cmd(self, scpi_str, paranoia_level=None):
+        '''Sends SCPI command (see the instrument's `send_scpi_cmd`).
+        :returns: error-code.
+        '''
+        return await self.run(
+            self._inst.send_scpi_cmd, scpi_str, paranoia_level)
+
+    async def send_scpi_query(self, scpi_str, *args):
+        '''Sends SCPI query (see the instrument's `send_scpi_query`).
+        :returns: response-string
+        '''
+        return await self.run(self._inst.send_scpi_query, scpi_str, *args)
+
+    async def write_binary_data(self, scpi_pref, bin_dat, *args, **kwargs):
+        '''Sends block of binary-data (see the instrument's `write_binary_data`).
+
+        The array must not be changed till the call is done.
+
+        :returns: zero if succeeded; otherwise, error code.
+        '''
+        return await self.run(
+            self._inst.write_binary_data, scpi_pref, bin_dat, *args, **kwargs)
+
+    async def read_binary_data(self, scpi_pref, out_array, *args, **kwargs):
+        '''Reads block of binary-data (see the instrument's `read_binary_data`).
+        :returns: error-code (zero for success).
+        '''
+        return await self.run(
+            self._inst.read_binary_data, scpi_pref, out_array, *args, **kwargs)
+
+    async def wait_for_frames(
+            self,
+            timeout=10.0,
+            poll_interval=0.01,
+            status_query=':DIG:ACQuire:FRAM:STAT?',
+            done=frames_done):
+        '''
+        Polls the digitizer's frame-status till all the frames are captured,
+        sleeping asynchronously between the queries (instead of `time.sleep`).
+
+        :param timeout: maximal time to wait in seconds (None: no limit).
+        :param poll_interval: time between the queries in seconds.
+        :param status_query: the status query.
+        :param done: function of the response that tells if it is done.
+        :returns: the last status response.
+        :raises asyncio.TimeoutError: if not done within the timeout.
+        '''
+        start = time.monotonic()
+        while True:
+            resp = await self.send_scpi_query(status_query)
+            if done(resp):
+                return resp
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise asyncio.TimeoutError(
+                    'frames not captured after {0} s (last status: {1})'.format(
+                        timeout, resp))
+            await asyncio.sleep(poll_interval)
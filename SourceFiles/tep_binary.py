@@ -0,0 +1,135 @@
+'''
+tep_binary - binary-data buffers for the Proteus drivers.
+
+Both drivers (:class:`teproteus.TEProteusInst` and
+:class:`tevisainst.TEVisaInst`) accept in `write_binary_data` any object
+that supports the buffer-protocol: `numpy` arrays (also `np.memmap` and
+non-contiguous slices), `memoryview`, `bytes` and `bytearray`.
+
+The data is sent straight from the caller's memory whenever it is
+contiguous. Non-contiguous data is copied through a scratch buffer of one
+chunk at a time, so there is never a full-size copy, and every byte that is
+copied in Python is counted (see `get_copied_bytes` of the drivers).
+'''
+
+import re
+
+import numpy as np
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['as_array', 'iter_chunks', 'ieee_header', 'trace_data_offset',
+           'CHUNK_BYTES']
+
+# the default chunk size (bytes) of the non-contiguous data
+CHUNK_BYTES = 2**20
+
+_TRACE_DATA = re.compile(
+    r'^\s*:?TRAC(?:E)?:DATA(?:\s+(\d+))?\s*,?\s*$', re.IGNORECASE)
+
+
+def as_array(bin_dat, dtype=None):
+    '''
+    Gets a `numpy` view of the binary-data (without copying, if possible).
+
+    :param bin_dat: `numpy` array or buffer-protocol object (or a sequence).
+    :param dtype: the data-type of the elements (optional).
+    :returns: tuple `(array, copied_bytes)`.
+    '''
+    if isinstance(bin_dat, np.ndarray):
+        arr = bin_dat
+    else:
+        try:
+            arr = np.asarray(memoryview(bin_dat))
+        except TypeError:
+            arr = np.asarray(bin_dat, dtype=dtype)
+            return arr, arr.nbytes
+
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if arr.dtype != dtype:
+            if arr.flags.c_contiguous and arr.dtype.itemsize == dtype.itemsize \
+                    and arr.dtype.kind in 'uiV' and dtype.kind in 'ui':
+                # same bytes, other integer type
+                return arr.view(dtype), 0
+            arr = arr.astype(dtype)
+            return arr, arr.nbytes
+
+    return arr, 0
+
+
+def _rows(arr):
+    '''Yields the array as 1-D views (no copy).'''
+    if arr.ndim <= 1:
+        yield arr.reshape(-1)
+    elif arr.flags.c_contiguous:
+        yield arr.reshape(-1)
+    else:
+        for sub in arr:
+            for row in _rows(sub):
+                yield row
+
+
+def iter_chunks(arr, chunk_bytes=CHUNK_BYTES, align=1):
+    '''
+    Yields the data of the array (in C order) as contiguous 1-D chunks.
+
+    Contiguous arrays are yielded as views (one chunk); otherwise the
+    data is copied into a scratch buffer of `chunk_bytes` that is reused
+    for all the chunks (so the caller must send every chunk before taking
+    the next one).
+
+    :param arr: `numpy` array.
+    :param chunk_bytes: the maximal chunk size in bytes (non-contiguous data).
+    :param align: the number of elements in a chunk is a multiple of this
+                  (except in the last chunk).
+    :returns: generator of tuples `(chunk, copied_bytes)`.
+    '''
+    if arr.flags.c_contiguous:
+        yield arr.reshape(-1), 0
+        return
+
+    itemsize = max(1, arr.dtype.itemsize)
+    align = max(1, int(align))
+    chunk_len = max(align, int(chunk_bytes) // itemsize // align * align)
+    scratch = np.empty(min(chunk_len, arr.size), dtype=arr.dtype)
+    fill = 0
+
+    for row in _rows(arr):
+        pos = 0
+        while pos < len(row):
+            num = min(len(scratch) - fill, len(row) - pos)
+            scratch[fill:fill + num] = row[pos:pos + num]
+            fill += num
+            pos += num
+            if fill == len(scratch):
+                yield scratch, scratch.nbytes
+                fill = 0
+
+    if fill:
+        yield scratch[:fill], fill * itemsize
+
+
+def ieee_header(num_bytes):
+    '''
+    Gets the IEEE 488.2 definite-length block header.
+
+    :param num_bytes: the data size in bytes.
+    :returns: the header (`bytes`), e.g. `b'#41024'`.
+    '''
+    size_str = str(int(num_bytes))
+    return '#{0}{1}'.format(len(size_str), size_str).encode()
+
+
+def trace_data_offset(scpi_pref):
+    '''
+    Checks if the SCPI prefix is a `:TRACe:DATA [<offset>,]` prefix.
+
+    :param scpi_pref: the SCPI prefix.
+    :returns: the offset (zero if not given), or None for other prefixes.
+    '''
+    match = _TRACE_DATA.match(str(scpi_pref or ''))
+    if match is None:
+        return None
+    return int(match.group(1)) if match.group(1) else 0
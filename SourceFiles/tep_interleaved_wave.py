@@ -38,13 +38,14 @@ __all__ = [
     'untie_interleaved_four']
 
 
-def compose_interleaved_two(wave1, wave2):
+def compose_interleaved_two(wave1, wave2, out=None):
     '''
     Compose a two-dimensional interleaved waveform
     from the given two (one-dimensional) waveforms.
 
     :param wave1: the first wave (a `numpy` array of `uint16` items).
     :param wave2: the second wave (a `numpy` array of `uint16` items).
+    :param out: the array to compose into (optional, `2 * len(wave1)` `uint16` items).
     :returns: 2-dimensional interleaved wave (`numpy` array of `uint16` items).
     '''
 
@@ -52,20 +53,21 @@ def compose_interleaved_two(wave1, wave2):
 
     half_len = len(wave1)
 
-    a = np.empty(2 * half_len, dtype=np.uint16)
-    b = a.view()
-    b.shape = (half_len, 2)
+    a = _out_array(out, 2 * half_len)
+    b = a.reshape(half_len, 2)
     b[:, 0] = wave1
     b[:, 1] = wave2
     return a
 
 
-def untie_interleaved_two(w):
+def untie_interleaved_two(w, out=None, copy=True):
     '''
     Untie a two-dimensional interleaved waveform
     into two one-dimensional waveforms.
 
     :param w: 2-dimensional interleaved wave (`numpy` array of `uint16` items).
+    :param out: two arrays to untie into (optional, `len(w) // 2` `uint16` items each).
+    :param copy: if `False` (and no `out`), return strided views into `w` instead of copies.
     :returns: two 1-dimensional waves. (2 `numpy` arrays of `uint16` items).
     '''
 
@@ -73,24 +75,33 @@ def untie_interleaved_two(w):
 
     half_len = len(w) // 2
 
-    w1 = np.empty(half_len, dtype=np.uint16)
-    w2 = np.empty(half_len, dtype=np.uint16)
-    a = w.view()
-    a.shape = (half_len, 2)
+    a = w.reshape(half_len, 2)
+    if out is None and not copy:
+        return a[:, 0], a[:, 1]
+
+    if out is None:
+        out = (None, None)
+
+    w1 = _out_array(out[0], half_len)
+    w2 = _out_array(out[1], half_len)
     w1[:] = a[:, 0]
     w2[:] = a[:, 1]
     return w1, w2
 
 
-def compose_interleaved_four(w1, w2, w3, w4):
+def compose_interleaved_four(w1, w2, w3, w4, out=None):
     '''
     Compose a four-dimensional interleaved waveform
     from the given four (one-dimensional) waveforms.
 
+    Every point takes 8 bytes: the low bytes of the four waves,
+    followed by their high bytes.
+
     :param w1: the first wave (a `numpy` array of `uint16` items).
     :param w2: the second wave (a `numpy` array of `uint16` items).
     :param w3: the third wave (a `numpy` array of `uint16` items).
     :param w4: the fourth wave (a `numpy` array of `uint16` items).
+    :param out: the array to compose into (optional, `4 * len(w1)` `uint16` items).
     :returns: 2-dimensional interleaved wave (`numpy` array of `uint16` items).
     '''
 
@@ -98,6 +109,71 @@ def compose_interleaved_four(w1, w2, w3, w4):
 
     fourth_len = len(w1)
 
+    w = _out_array(out, 4 * fourth_len)
+
+    # a[n, b, k] is byte b (low, high) of point n of wave k
+    a = w.view(np.uint8).reshape(fourth_len, 2, 4)
+
+    for k, wk in enumerate((w1, w2, w3, w4)):
+        a[:, :, k] = _as_uint16(wk).view(np.uint8).reshape(fourth_len, 2)
+
+    return w
+
+
+def untie_interleaved_four(w, out=None):
+    '''
+    Untie a four-dimensional interleaved waveform
+    into four one-dimensional waveforms.
+
+    The bytes of every point of a wave are not next to each other
+    in `w`, so the waves are always copied (into `out`, if given).
+
+    :param w: 4-dimensional interleaved wave (`numpy` array of `uint16` items).
+    :param out: four arrays to untie into (optional, `len(w) // 4` `uint16` items each).
+    :returns: four 1-dimensional waves. (4 `numpy` arrays of `uint16` items).
+    '''
+
+    assert (len(w) % 4 == 0)
+
+    fourth_len = len(w) // 4
+
+    if out is None:
+        out = (None, None, None, None)
+
+    waves = tuple(_out_array(wk, fourth_len) for wk in out)
+
+    a = _as_uint16(w).view(np.uint8).reshape(fourth_len, 2, 4)
+
+    for k, wk in enumerate(waves):
+        wk.view(np.uint8).reshape(fourth_len, 2)[:] = a[:, :, k]
+
+    return waves
+
+
+def _out_array(out, length):
+    '''Gets the given output array (checked), or a new one.'''
+
+    if out is None:
+        return np.empty(length, dtype=np.uint16)
+
+    if out.dtype != np.uint16 or out.shape != (length,) or not out.flags.c_contiguous:
+        raise ValueError(
+            'out should be a contiguous array of {0} uint16 items'.format(length))
+
+    return out
+
+
+def _as_uint16(w):
+    '''Gets the wave as a contiguous `uint16` array (without copying, if it is one).'''
+
+    return np.ascontiguousarray(w, dtype=np.uint16)
+
+
+def _compose_interleaved_four_loop(w1, w2, w3, w4):
+    '''The byte-by-byte implementation of compose_interleaved_four (for reference).'''
+
+    fourth_len = len(w1)
+
     w = np.empty(4 * fourth_len, dtype=np.uint16)
 
     a = w.view(np.uint8)
@@ -120,16 +196,8 @@ def compose_interleaved_four(w1, w2, w3, w4):
     return w
 
 
-def untie_interleaved_four(w):
-    '''
-    Untie a four-dimensional interleaved waveform
-    into four one-dimensional waveforms.
-
-    :param w: 4-dimensional interleaved wave (`numpy` array of `uint16` items).
-    :returns: four 1-dimensional waves. (4 `numpy` arrays of `uint16` items).
-    '''
-
-    assert (len(w) % 4 == 0)
+def _untie_interleaved_four_loop(w):
+    '''The byte-by-byte implementation of untie_interleaved_four (for reference).'''
 
     fourth_len = len(w) // 4
 
@@ -156,3 +224,51 @@ def untie_interleaved_four(w):
         a4[2 * n + 1] = a[n * 8 + 7]
 
     return w1, w2, w3, w4
+
+
+def benchmark_interleaved_four(fourth_len=2**20, loop_len=2**16, repeat=3):
+    '''
+    Times the byte-by-byte and the vectorized four-way compose / untie,
+    and checks that they give the same result.
+
+    :param fourth_len: points per wave for the vectorized functions.
+    :param loop_len: points per wave for the (slow) byte-by-byte loops.
+    :param repeat: how many times to run each (the best time is taken).
+    :returns: dict of the throughput (points per wave per second) of each.
+    '''
+
+    import timeit
+
+    rng = np.random.default_rng(0)
+    waves = [rng.integers(0, 2**16, fourth_len, dtype=np.uint16)
+             for _ in range(4)]
+    short = [wk[:loop_len] for wk in waves]
+    buff = np.empty(4 * fourth_len, dtype=np.uint16)
+    outs = tuple(np.empty(fourth_len, dtype=np.uint16) for _ in range(4))
+
+    w = compose_interleaved_four(*waves)
+    assert np.array_equal(w[:4 * loop_len], _compose_interleaved_four_loop(*short))
+    assert all(np.array_equal(x, y) for x, y in zip(
+        untie_interleaved_four(w[:4 * loop_len]),
+        _untie_interleaved_four_loop(w[:4 * loop_len])))
+
+    def best(func, points):
+        return points / min(timeit.repeat(func, number=1, repeat=repeat))
+
+    results = {
+        'compose_loop': best(lambda: _compose_interleaved_four_loop(*short), loop_len),
+        'compose': best(lambda: compose_interleaved_four(*waves), fourth_len),
+        'compose_out': best(lambda: compose_interleaved_four(*waves, out=buff), fourth_len),
+        'untie_loop': best(lambda: _untie_interleaved_four_loop(w[:4 * loop_len]), loop_len),
+        'untie': best(lambda: untie_interleaved_four(w), fourth_len),
+        'untie_out': best(lambda: untie_interleaved_four(w, out=outs), fourth_len),
+    }
+
+    for name, rate in results.items():
+        print('{0:>12}: {1:12,.0f} points/s'.format(name, rate))
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_interleaved_four()
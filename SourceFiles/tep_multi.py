@@ -0,0 +1,193 @@
+'''
+tep_multi - parallel control of the Proteus modules of a chassis.
+
+:meth:`TEProteusAdmin.open_multi_slots_instrument` makes the modules one
+instrument, so everything sent to them runs one call at a time.
+The class :class:`tep_multi.MultiSlotSession` opens every slot as an
+instrument of its own, with its own worker thread
+(a :class:`tep_session.ProteusSession`), and fans jobs (waveform uploads,
+task-table writes, ...) out to all the slots in parallel. The DLL calls
+release the GIL, so the transfers to the modules really overlap.
+
+**Example of use**
+
+.. code-block:: python
+
+    from teproteus import TEProteusAdmin
+    from tep_multi import MultiSlotSession
+
+    with TEProteusAdmin() as admin:
+        with MultiSlotSession(admin) as multi:
+            # the same job on every slot
+            idns, timings = multi.run(
+                lambda inst: inst.send_scpi_query('*IDN?'))
+            # other arguments per slot
+            results, timings = multi.map(helpers.download_func, {
+                sid: (wave, 1, 1) for sid, wave in zip(multi.slot_ids, waves)})
+            print(timings['slots'], timings['speedup'])
+'''
+
+import time
+from collections import OrderedDict
+
+from tep_session import ProteusSession, PRIORITY_BULK
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['MultiSlotSession']
+
+
+def _timed(inst, func, args, kwargs):
+    '''Runs the job, and measures its time.'''
+    t_start = time.perf_counter()
+    result = func(inst, *args, **kwargs)
+    return result, time.perf_counter() - t_start
+
+
+class MultiSlotSession(object):
+    '''
+    One instrument (and one worker thread) per PXI slot.
+    '''
+
+    def __init__(self, admin, slot_ids=None, reset_hot_flag=True,
+                 paranoia_level=None):
+        '''
+        Constructor.
+
+        :param admin: the :class:`teproteus.TEProteusAdmin`.
+        :param slot_ids: the slots to open (default: all the slots).
+        :param reset_hot_flag: should reset the system-hot flag?
+        :param paranoia_level: the default paranoia-level of the
+                               instruments (None: keep the default).
+        '''
+        if slot_ids is None:
+            slot_ids = admin.get_slot_ids()
+
+        self._insts = OrderedDict()
+        self._sessions = OrderedDict()
+        try:
+            for sid in slot_ids:
+                sid = int(sid)
+                inst = admin.open_instrument(
+                    slot_id=sid, reset_hot_flag=reset_hot_flag)
+                if inst is None:
+                    raise RuntimeError(
+                        'failed to open the instrument of slot {0}'.format(sid))
+                if paranoia_level is not None:
+                    inst.default_paranoia_level = paranoia_level
+                self._insts[sid] = inst
+                self._sessions[sid] = ProteusSession(
+                    inst, name='proteus-slot-{0}'.format(sid))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del exc_type, exc_value, traceback
+        self.close()
+
+    @property
+    def slot_ids(self):
+        '''The slot identifiers (in order).'''
+        return list(self._insts)
+
+    def inst(self, slot_id):
+        '''Gets the instrument of a slot (use it only inside jobs).'''
+        return self._insts[slot_id]
+
+    def session(self, slot_id):
+        '''Gets the :class:`tep_session.ProteusSession` of a slot.'''
+        return self._sessions[slot_id]
+
+    def close(self):
+        '''Stops the worker threads and closes the instruments.'''
+        sessions, self._sessions = self._sessions, OrderedDict()
+        for sess in sessions.values():
+            sess.close()
+        insts, self._insts = self._insts, OrderedDict()
+        for inst in insts.values():
+            inst.close_instrument()
+
+    def map(self, func, jobs, priority=PRIORITY_BULK):
+        '''
+        Runs `func(inst, *args)` on the slots in parallel, with other
+        arguments per slot.
+
+        The jobs of all the slots are submitted first and then waited for;
+        if some of them fail, the first error is raised after all are done.
+
+        :param func: the function (takes the instrument first).
+        :param jobs: dictionary of slot-id to the tuple of arguments
+                     (or to a dictionary with `args` and `kwargs`).
+        :param priority: the priority of the jobs (see `tep_session`).
+        :returns: tuple `(results, timings)`, where `results` is a
+                  dictionary of slot-id to the function's result, and
+                  `timings` is a dictionary with the keys `slots`
+                  (slot-id to seconds), `wall` (seconds of the whole),
+                  `serial` (sum of the slots) and `speedup`.
+        '''
+        t_start = time.perf_counter()
+
+        futures = OrderedDict()
+        for sid, job in jobs.items():
+            if isinstance(job, dict):
+                args, kwargs = tuple(job.get('args', ())), dict(job.get('kwargs', {}))
+            else:
+                args, kwargs = tuple(job), {}
+            futures[sid] = self._sessions[sid].submit(
+                _timed, func, args, kwargs, priority=priority)
+
+        results, seconds, error = OrderedDict(), OrderedDict(), None
+        for sid, fut in futures.items():
+            try:
+                results[sid], seconds[sid] = fut.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                if error is None:
+                    error = RuntimeError(
+                        'slot {0}: {1!r}'.format(sid, ex))
+                    error.__cause__ = ex
+
+        wall = time.perf_counter() - t_start
+        if error is not None:
+            raise error
+
+        serial = sum(seconds.values())
+        timings = {
+            'slots': seconds,
+            'wall': wall,
+            'serial': serial,
+            'speedup': serial / wall if wall > 0 else 0.0}
+        return results, timings
+
+    def run(self, func, *args, slots=None, priority=PRIORITY_BULK, **kwargs):
+        '''
+        Runs the same `func(inst, *args, **kwargs)` on the slots in parallel.
+
+        :param func: the function (takes the instrument first).
+        :param slots: the slot-ids (default: all the slots).
+        :param priority: the priority of the jobs (see `tep_session`).
+        :returns: tuple `(results, timings)` (see :meth:`map`).
+        '''
+        if slots is None:
+            slots = self.slot_ids
+        return self.map(
+            func, dict((sid, {'args': args, 'kwargs': kwargs}) for sid in slots),
+            priority=priority)
+
+    def send_scpi_cmd(self, scpi_str, slots=None):
+        '''Sends SCPI command to the slots (in parallel).
+        :returns: dictionary of slot-id to error-code.
+        '''
+        return self.run(
+            lambda inst: inst.send_scpi_cmd(scpi_str), slots=slots)[0]
+
+    def send_scpi_query(self, scpi_str, slots=None):
+        '''Sends SCPI query to the slots (in parallel).
+        :returns: dictionary of slot-id to response-string.
+        '''
+        return self.run(
+            lambda inst: inst.send_scpi_query(scpi_str), slots=slots)[0]
@@ -0,0 +1,340 @@
+'''
+tep_scpi_batch - batching and deferred error-checking of SCPI commands
+for Proteus instruments.
+
+The class :class:`tep_scpi_batch.ScpiBatch` collects the SCPI commands sent
+by :meth:`send_scpi_cmd` of an instrument (either
+:class:`teproteus.TEProteusInst` or :class:`tevisainst.TEVisaInst`),
+joins them with `;` up to a safe length, sends every joined string as a single
+bare command, and checks the instrument's error-queue once at the end.
+
+The class :class:`tep_scpi_batch.ErrorLog` sends the commands bare and keeps
+a ring-buffer of the last commands, and drains the error-queue only at
+checkpoints, where every error is attributed to the command that most
+probably caused it.
+
+**Example of use**
+
+.. code-block:: python
+
+    with inst.batch():
+        for i in range(1000):
+            inst.send_scpi_cmd(':TASK:COMP:SEL {0}'.format(i + 1))
+            inst.send_scpi_cmd(':TASK:COMP:SEGM {0}'.format(i + 1))
+        # queries (and binary transfers) flush the pending commands first
+        resp = inst.send_scpi_query(':TASK:COMP:LENG?')
+
+    inst.defer_errors(depth=256)
+    ...
+    # e.g. after writing a task-table, or before an acquisition
+    for err in inst.checkpoint('task-table'):
+        print(err['error'], 'caused by', err['command'])
+'''
+
+import re
+import warnings
+from collections import deque
+from contextlib import contextmanager
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['ScpiBatch', 'ErrorLog', 'is_error_query']
+
+
+def is_error_query(scpi_str):
+    '''Checks if the given SCPI string is a `:SYST:ERR?` query.'''
+    cmd = str(scpi_str).strip().upper().lstrip(':')
+    return cmd in ('SYST:ERR?', 'SYSTEM:ERROR?', 'SYST:ERR:NEXT?', 'SYSTEM:ERROR:NEXT?')
+
+
+@contextmanager
+def _bare(inst):
+    '''Sends (inside the block) straight to the instrument, with no batch and no error-log.'''
+    # pylint: disable=protected-access
+    batch, log = inst._scpi_batch, inst._error_log
+    inst._scpi_batch, inst._error_log = None, None
+    try:
+        yield
+    finally:
+        inst._scpi_batch, inst._error_log = batch, log
+
+
+def _drain_errors(inst, max_errors):
+    '''Reads the instrument's error-queue till it is empty.'''
+    errors = []
+    with _bare(inst):
+        for _ in range(max_errors):
+            resp_str = str(inst.send_scpi_query(':SYST:ERR?')).strip()
+            if not resp_str or resp_str.startswith('0'):
+                break
+            errors.append(resp_str)
+        if errors:
+            inst.send_scpi_cmd('*CLS', paranoia_level=0)
+    return errors
+
+
+class ScpiBatch(object):
+    '''
+    Collects the SCPI commands of an instrument and sends them joined.
+
+    While the batch is active (inside the `with` block) the instrument's
+    :meth:`send_scpi_cmd` only queues the command and returns zero; the
+    `paranoia_level` of the single commands is ignored, and the errors are
+    checked once, when the batch ends.
+    '''
+
+    def __init__(self, inst, max_len=1024, check_errors=True):
+        '''
+        Constructor.
+
+        User should normally call the `batch` method of the instrument.
+
+        :param inst: the instrument (with `_scpi_batch` attribute).
+        :param max_len: the maximal length of a joined SCPI string.
+        :param check_errors: should check `:SYST:ERR?` when the batch ends?
+        '''
+        self._inst = inst
+        self._max_len = int(max_len)
+        self._check_errors = bool(check_errors)
+        self._pending = []
+        self._pending_len = 0
+        self._entries = []
+        self._outer = None
+        self.num_commands = 0
+        self.num_transactions = 0
+        self.errors = []
+
+    def __enter__(self):
+        # pylint: disable=protected-access
+        self._outer = self._inst._scpi_batch
+        if self._outer is not None:
+            # nested batch: the outer one keeps collecting
+            return self._outer
+        self._inst._scpi_batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del exc_value, traceback
+        if self._outer is not None:
+            return
+        try:
+            self.flush()
+        finally:
+            # pylint: disable=protected-access
+            self._inst._scpi_batch = None
+        if self._check_errors and exc_type is None:
+            self.check_errors()
+
+    def add(self, scpi_str, entry=None):
+        '''
+        Queue a SCPI command (flush first if the joined string gets too long).
+
+        Commands without a leading `:` or `*` get a leading `:`, so that
+        they are not taken relative to the previous command in the string.
+
+        :param scpi_str: the SCPI command.
+        :param entry: the command's entry in the `ErrorLog` (if any).
+        :returns: zero (the error-code is known only at the end).
+        '''
+        scpi_str = str(scpi_str).strip()
+        if not scpi_str:
+            return 0
+        if scpi_str[0] not in ':*':
+            scpi_str = ':' + scpi_str
+
+        if self._pending and \
+                self._pending_len + 1 + len(scpi_str) > self._max_len:
+            self.flush()
+
+        self._pending.append(scpi_str)
+        self._pending_len += len(scpi_str) + 1
+        if entry is not None:
+            self._entries.append(entry)
+        self.num_commands += 1
+        return 0
+
+    def flush(self):
+        '''
+        Send the queued commands (as a single bare SCPI string).
+
+        :returns: the error-code of the transaction (zero if nothing to send).
+        '''
+        if not self._pending:
+            return 0
+
+        cmd = ';'.join(self._pending)
+        entries = self._entries
+        self._pending = []
+        self._pending_len = 0
+        self._entries = []
+
+        with _bare(self._inst):
+            ret_code = self._inst.send_scpi_cmd(cmd, paranoia_level=0)
+
+        for entry in entries:
+            entry[2] = ret_code
+
+        self.num_transactions += 1
+        return ret_code
+
+    def check_errors(self, max_errors=100):
+        '''
+        Read the instrument's error-queue (till it is empty) and warn
+        about the errors found.
+
+        If the instrument has an `ErrorLog` the errors are read through
+        its checkpoint (so they are attributed to the commands).
+
+        :param max_errors: the maximal number of errors to read.
+        :returns: list of the error strings (also kept in `errors`).
+        '''
+        # pylint: disable=protected-access
+        if self._inst._error_log is not None:
+            errors = [err['error'] for err in self._inst._error_log.checkpoint(
+                'batch', max_errors)]
+        else:
+            errors = _drain_errors(self._inst, max_errors)
+            if errors:
+                wrnmsg = 'SCPI batch of {0} commands, SYST:ERR: {1}'.format(
+                    self.num_commands, '; '.join(errors))
+                warnings.warn(wrnmsg)
+
+        self.errors.extend(errors)
+        return errors
+
+
+class ErrorLog(object):
+    '''
+    Deferred error-checking of the SCPI commands of an instrument.
+
+    While the instrument has an error-log, :meth:`send_scpi_cmd` sends bare
+    commands (paranoia-level 0, unless given explicitly), and the last
+    `depth` commands are kept in a ring-buffer with their return-codes.
+    The error-queue is drained only at checkpoints (:meth:`checkpoint`,
+    and any `:SYST:ERR?` query sent to the instrument), and every error
+    is attributed to the most probable command since the last checkpoint:
+
+     - a command whose transaction returned a non-zero code, or else
+     - the last command whose header is mentioned in the error message.
+
+    Failed transactions are reported at the checkpoint too, even if they
+    left nothing in the error-queue.
+    '''
+
+    def __init__(self, inst, depth=256):
+        '''
+        Constructor.
+
+        User should normally call the `defer_errors` method of the instrument.
+
+        :param inst: the instrument (with `_error_log` attribute).
+        :param depth: the number of commands to remember.
+        '''
+        self._inst = inst
+        self._ring = deque(maxlen=int(depth))
+        self._count = 0
+        self._last_checkpoint = 0
+        self.errors = []
+
+    def record(self, scpi_str):
+        '''
+        Remember a command (the oldest one is forgotten if the buffer is full).
+
+        :param scpi_str: the SCPI command.
+        :returns: the entry `[number, command, return-code]`, where the
+                  return-code is filled in when the command is sent.
+        '''
+        self._count += 1
+        entry = [self._count, str(scpi_str).strip(), None]
+        self._ring.append(entry)
+        return entry
+
+    def window(self):
+        '''Gets the remembered entries since the last checkpoint.'''
+        return [entry for entry in self._ring
+                if entry[0] > self._last_checkpoint]
+
+    def checkpoint(self, label='', max_errors=100):
+        '''
+        Drain the error-queue, and attribute every error to a command.
+
+        :param label: name of the checkpoint (for the warnings).
+        :param max_errors: the maximal number of errors to read.
+        :returns: list of dictionaries with the keys `error` (the response
+                  string), `code`, `command` (the suspected command, or
+                  `None`), `number` (its number) and `window` (the commands
+                  since the previous checkpoint).
+        '''
+        window = self.window()
+        lost = self._count - self._last_checkpoint - len(window)
+        self._last_checkpoint = self._count
+
+        found = []
+        for resp_str in _drain_errors(self._inst, max_errors):
+            suspect = self._suspect(resp_str, window)
+            try:
+                code = int(resp_str.split(',')[0])
+            except ValueError:
+                code = -1
+            err = {
+                'error': resp_str,
+                'code': code,
+                'command': suspect[1] if suspect else None,
+                'number': suspect[0] if suspect else None,
+                'window': [entry[1] for entry in window]}
+            found.append(err)
+
+            if suspect:
+                wrnmsg = 'CMD #{0}: "{1}", SYST:ERR: {2}'.format(
+                    suspect[0], suspect[1], resp_str)
+            else:
+                wrnmsg = 'SYST:ERR: {0} (one of the {1} commands since the ' \
+                    'previous checkpoint)'.format(resp_str, len(window) + lost)
+            if label:
+                wrnmsg = '[{0}] {1}'.format(label, wrnmsg)
+            warnings.warn(wrnmsg)
+
+        # failed transactions that left nothing in the error-queue
+        blamed = set(err['number'] for err in found)
+        for entry in window:
+            if entry[2] and entry[0] not in blamed:
+                err = {
+                    'error': 'transaction failed with error {0}'.format(entry[2]),
+                    'code': entry[2],
+                    'command': entry[1],
+                    'number': entry[0],
+                    'window': [entry[1] for entry in window]}
+                found.append(err)
+                wrnmsg = 'CMD #{0}: "{1}", {2}'.format(entry[0], entry[1], err['error'])
+                if label:
+                    wrnmsg = '[{0}] {1}'.format(label, wrnmsg)
+                warnings.warn(wrnmsg)
+
+        self.errors.extend(found)
+        return found
+
+    def checkpoint_response(self):
+        '''
+        Checkpoint that answers like a `:SYST:ERR?` query.
+
+        :returns: the first error string, or '0, no error'.
+        '''
+        found = self.checkpoint(':SYST:ERR?')
+        return found[0]['error'] if found else '0, no error'
+
+    @staticmethod
+    def _suspect(resp_str, window):
+        '''Gets the entry of the command that most probably caused the error.'''
+        failed = [entry for entry in window if entry[2]]
+        if failed:
+            return failed[0]
+
+        words = set(re.findall(r'[A-Za-z*]+', resp_str.upper()))
+        for entry in reversed(window):
+            header = entry[1].split(' ')[0].upper()
+            if any(part and part in words
+                   for part in re.split(r'[:;]', header)[-1:]):
+                return entry
+
+        return None
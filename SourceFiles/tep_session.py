@@ -0,0 +1,324 @@
+'''
+tep_session - thread-safe session of a Proteus instrument.
+
+The drivers (:class:`teproteus.TEProteusInst` and
+:class:`tevisainst.TEVisaInst`) have no locking: two threads that send
+commands to the same instrument can interleave their `:INST:CHAN` and
+`:TRAC:SEL` selections.
+
+The class :class:`tep_session.ProteusSession` owns the instrument and
+serializes all the access through one worker thread and a priority-queue:
+
+ - `PRIORITY_QUERY` (latency-sensitive queries, e.g. status polling),
+ - `PRIORITY_CMD` (commands),
+ - `PRIORITY_BULK` (binary transfers).
+
+Waveform uploads (:meth:`ProteusSession.upload_segment`) are split into
+chunks, every chunk is a separate job that re-selects its channel and
+segment, so that queries and commands can run between the chunks.
+
+Jobs of the same priority run in the order they were submitted.
+The queue depth and the wait times of every priority are published by
+:meth:`ProteusSession.metrics`.
+
+**Example of use**
+
+.. code-block:: python
+
+    from tep_session import ProteusSession
+
+    with ProteusSession(inst) as sess:
+        # in the main thread
+        done = sess.upload_segment(channel=1, segment=1, data=wave)
+        # in a monitor thread
+        resp = sess.send_scpi_query(':DIG:ACQuire:FRAM:STAT?')
+        # a sequence of commands that must not be interleaved
+        sess.call(lambda inst: [inst.send_scpi_cmd(':INST:CHAN 2'),
+                                inst.send_scpi_cmd(':OUTP ON')])
+        done.result()
+'''
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['ProteusSession',
+           'PRIORITY_QUERY', 'PRIORITY_CMD', 'PRIORITY_BULK']
+
+PRIORITY_QUERY = 0
+PRIORITY_CMD = 1
+PRIORITY_BULK = 2
+
+_PRIORITY_NAMES = {
+    PRIORITY_QUERY: 'query',
+    PRIORITY_CMD: 'cmd',
+    PRIORITY_BULK: 'bulk'}
+
+_STOP = 1 << 30
+
+
+class _Stats(object):
+    '''Counters of one priority.'''
+
+    def __init__(self):
+        self.depth = 0
+        self.submitted = 0
+        self.done = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def as_dict(self):
+        '''Gets the counters as a dictionary.'''
+        return {
+            'depth': self.depth,
+            'submitted': self.submitted,
+            'done': self.done,
+            'failed': self.failed,
+            'wait_mean': self.wait_total / self.done if self.done else 0.0,
+            'wait_max': self.wait_max,
+            'run_mean': self.run_total / self.done if self.done else 0.0}
+
+
+class ProteusSession(object):
+    '''
+    Serializes the access to an instrument through one worker thread.
+
+    All the methods may be called from any thread. The blocking methods
+    (`call`, `send_scpi_cmd`, ...) return the result; `submit` and
+    `upload_segment` return a :class:`concurrent.futures.Future`.
+    '''
+
+    def __init__(self, inst, chunk_points=2**20, name='proteus-session'):
+        '''
+        Constructor.
+
+        :param inst: the (open) instrument.
+        :param chunk_points: the number of points uploaded per job
+                             (rounded down to a multiple of 64).
+        :param name: the name of the worker thread.
+        '''
+        self._inst = inst
+        self._chunk_points = max(64, int(chunk_points) // 64 * 64)
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = dict((prio, _Stats()) for prio in _PRIORITY_NAMES)
+        self._closed = False
+        self._uploads = set()
+        self._worker = threading.Thread(
+            target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del exc_type, exc_value, traceback
+        self.close()
+
+    @property
+    def inst(self):
+        '''The instrument (use it only inside jobs, on the worker thread).'''
+        return self._inst
+
+    def close(self, wait=True):
+        '''
+        Stops the worker thread, after the jobs (and uploads) already submitted.
+
+        :param wait: wait for the worker thread to finish?
+        '''
+        if threading.current_thread() is not self._worker:
+            with self._lock:
+                uploads = list(self._uploads)
+            for fut in uploads:
+                fut.exception()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put((_STOP, next(self._seq), None))
+        if wait and threading.current_thread() is not self._worker:
+            self._worker.join()
+
+    def submit(self, func, *args, priority=PRIORITY_CMD, **kwargs):
+        '''
+        Queues a job: `func(inst, *args, **kwargs)` on the worker thread.
+
+        :param func: the function (takes the instrument first).
+        :param priority: one of the `PRIORITY_*` (lower runs first).
+        :returns: :class:`concurrent.futures.Future` of the function's result.
+        '''
+        if priority not in self._stats:
+            raise ValueError('unknown priority {0}'.format(priority))
+        fut = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('the session is closed')
+            stats = self._stats[priority]
+            stats.depth += 1
+            stats.submitted += 1
+        job = (fut, func, args, kwargs, time.monotonic())
+        self._queue.put((priority, next(self._seq), job))
+        return fut
+
+    def call(self, func, *args, priority=PRIORITY_CMD, **kwargs):
+        '''
+        Runs `func(inst, *args, **kwargs)` on the worker thread and waits for it.
+
+        Called from inside a job, the function runs right away (the
+        worker thread already owns the instrument).
+
+        :returns: the function's return value.
+        '''
+        if threading.current_thread() is self._worker:
+            return func(self._inst, *args, **kwargs)
+        return self.submit(func, *args, priority=priority, **kwargs).result()
+
+    def send_scpi_cmd(self, scpi_str, paranoia_level=None, priority=PRIORITY_CMD):
+        '''Sends SCPI command (see the instrument's `send_scpi_cmd`).
+        :returns: error-code.
+        '''
+        return self.call(
+            lambda inst: inst.send_scpi_cmd(scpi_str, paranoia_level),
+            priority=priority)
+
+    def send_scpi_query(self, scpi_str, priority=PRIORITY_QUERY):
+        '''Sends SCPI query (see the instrument's `send_scpi_query`).
+        :returns: response-string
+        '''
+        return self.call(
+            lambda inst: inst.send_scpi_query(scpi_str), priority=priority)
+
+    def write_binary_data(self, scpi_pref, bin_dat, priority=PRIORITY_BULK):
+        '''Sends block of binary-data as one job (see the instrument's `write_binary_data`).
+        :returns: zero if succeeded; otherwise, error code.
+        '''
+        return self.call(
+            lambda inst: inst.write_binary_data(scpi_pref, bin_dat),
+            priority=priority)
+
+    def read_binary_data(self, scpi_pref, out_array, num_bytes, priority=PRIORITY_BULK):
+        '''Reads block of binary-data as one job (see the instrument's `read_binary_data`).
+        :returns: error-code (zero for success).
+        '''
+        return self.call(
+            lambda inst: inst.read_binary_data(scpi_pref, out_array, num_bytes),
+            priority=priority)
+
+    def upload_segment(self, channel, segment, data, define=True,
+                       priority=PRIORITY_BULK):
+        '''
+        Uploads a waveform to a segment, in chunks that can be preempted.
+
+        Every chunk is a separate job that selects the channel and the
+        segment and writes at its offset (`:TRAC:DATA <offset>,<data>`),
+        the next chunk is queued when the previous one is done.
+        The array must not be changed till the upload is done.
+
+        :param channel: the channel number.
+        :param segment: the segment number.
+        :param data: the waveform data (`numpy` array, in DAC units).
+        :param define: define the segment (`:TRAC:DEF`) first?
+        :param priority: the priority of the chunks.
+        :returns: :class:`concurrent.futures.Future` that is done (with
+                  the number of chunks) after the last chunk.
+        '''
+        done = Future()
+        with self._lock:
+            self._uploads.add(done)
+        done.add_done_callback(self._upload_done)
+        num_points = len(data)
+        select = ':INST:CHAN {0};:TRAC:SEL {1}'.format(channel, segment)
+
+        def write_chunk(inst, offset):
+            if offset == 0 and define:
+                ret_code = inst.send_scpi_cmd(
+                    ':INST:CHAN {0};:TRAC:DEF {1},{2}'.format(
+                        channel, segment, num_points))
+                if ret_code:
+                    raise RuntimeError(
+                        'defining segment {0} failed with error {1}'.format(
+                            segment, ret_code))
+            inst.send_scpi_cmd(select)
+            stop = min(offset + self._chunk_points, num_points)
+            ret_code = inst.write_binary_data(
+                ':TRAC:DATA {0},'.format(offset), data[offset:stop])
+            if ret_code:
+                raise RuntimeError(
+                    'writing segment {0} at {1} failed with error {2}'.format(
+                        segment, offset, ret_code))
+            return stop
+
+        def chain(fut):
+            try:
+                stop = fut.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                done.set_exception(ex)
+                return
+            if stop >= num_points:
+                done.set_result(-(-num_points // self._chunk_points))
+                return
+            try:
+                self.submit(write_chunk, stop, priority=priority).add_done_callback(chain)
+            except RuntimeError as ex:
+                done.set_exception(ex)
+
+        self.submit(write_chunk, 0, priority=priority).add_done_callback(chain)
+        return done
+
+    def _upload_done(self, fut):
+        with self._lock:
+            self._uploads.discard(fut)
+
+    def metrics(self):
+        '''
+        Gets the queue metrics of every priority.
+
+        :returns: dictionary of priority-name to a dictionary with the keys
+                  `depth` (jobs waiting now), `submitted`, `done`, `failed`,
+                  `wait_mean` and `wait_max` (seconds in the queue), and
+                  `run_mean` (seconds running).
+        '''
+        with self._lock:
+            return dict((_PRIORITY_NAMES[prio], stats.as_dict())
+                        for prio, stats in self._stats.items())
+
+    def _run(self):
+        '''The worker thread.'''
+        while True:
+            priority, _, job = self._queue.get()
+            if priority == _STOP:
+                break
+            fut, func, args, kwargs, t_queued = job
+            t_start = time.monotonic()
+            with self._lock:
+                stats = self._stats[priority]
+                stats.depth -= 1
+                stats.wait_total += t_start - t_queued
+                stats.wait_max = max(stats.wait_max, t_start - t_queued)
+
+            if not fut.set_running_or_notify_cancel():
+                with self._lock:
+                    stats.done += 1
+                continue
+
+            failed = False
+            try:
+                result = func(self._inst, *args, **kwargs)
+            except BaseException as ex:  # pylint: disable=broad-except
+                failed = True
+                fut.set_exception(ex)
+            else:
+                fut.set_result(result)
+
+            with self._lock:
+                stats.done += 1
+                stats.failed += int(failed)
+                stats.run_total += time.monotonic() - t_start
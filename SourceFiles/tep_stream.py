@@ -0,0 +1,305 @@
+'''
+tep_stream - continuous streaming playback for Proteus instruments.
+
+The class :class:`tep_stream.StreamPlayer` plays a waveform given as a
+sequence of blocks (e.g. the output of `pulse_lib` streaming methods)
+through the stream-writing interface of :class:`teproteus.TEProteusInst`,
+so the waveform can be longer than the segment memory.
+
+A producer thread copies the blocks into packets of
+`get_stream_packet_size()` bytes, in a ring of preallocated buffers;
+a sender thread pushes the full packets (`push_stream_packet`) and gives
+the buffers back to the producer. When the instrument is not ready the push
+times out after `usec_wait` microseconds and is retried, and when the ring
+is full the producer waits, so the producer never runs ahead of the
+instrument by more than the ring.
+
+The stream-writing interface belongs to the instrument, not to the player:
+given a channel, the player acquires it (`acquire_stream_intf`) on
+:meth:`StreamPlayer.start`, but the driver has no call that releases it,
+so it stays acquired after the playback (also after an error) until the
+instrument is closed (`close_instrument`). The caller owns it from then on,
+e.g. to play more blocks with `channel=None`.
+
+**Example of use**
+
+.. code-block:: python
+
+    from tep_stream import StreamPlayer
+
+    # 50 ns slopes and a 10 us plateau
+    blocks = pulse.readout_pulse_stream(
+        0.5, 50e-9, 10e-6, 50e6, data_type=np.uint16)
+
+    with StreamPlayer(inst, channel=1, blocks=blocks) as player:
+        stats = player.wait()
+    print(stats['throughput'], stats['underruns'])
+'''
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+__version__ = '1.0.1'
+__docformat__ = 'reStructuredText'
+
+__all__ = ['StreamPlayer']
+
+
+class StreamPlayer(object):
+    '''
+    Plays a sequence of blocks through the stream-writing interface.
+
+    The blocks are `numpy` arrays in DAC format (sent as their raw bytes),
+    or pairs `(I, Q)` of such arrays, which are interleaved (as
+    `helpers.IQ_interleaver`). The blocks are copied into the packets, so
+    the generator may reuse its buffers.
+    '''
+
+    def __init__(self, inst, channel, blocks, ring=8, usec_wait=1000,
+                 packet_size=None, pad_value=None, prefill=True):
+        '''
+        Constructor.
+
+        :param inst: the instrument (:class:`teproteus.TEProteusInst`).
+        :param channel: the channel number, whose stream-writing interface
+                        is acquired on start and left to the caller at the
+                        end (None: the interface was already acquired).
+        :param blocks: iterable of the blocks.
+        :param ring: the number of packet buffers.
+        :param usec_wait: the timeout of every push in microseconds.
+        :param packet_size: the packet size in bytes (default: the
+                            instrument's `get_stream_packet_size()`).
+        :param pad_value: the value that pads the last packet (default:
+                          the middle of the DAC range for unsigned types).
+        :param prefill: fill the ring before the first push?
+        '''
+        self._inst = inst
+        self._channel = channel
+        self._blocks = blocks
+        self._ring_len = max(2, int(ring))
+        self._usec_wait = int(usec_wait)
+        self._packet_size = packet_size
+        self._pad_value = pad_value
+        self._prefill = bool(prefill)
+
+        self._ring = None
+        self._empty = queue.Queue()
+        self._full = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._iq_buff = None
+
+        self._t_start = None
+        self._t_end = None
+        self._packets = 0
+        self._underruns = 0
+        self._underrun_time = 0.0
+        self._stalls = 0
+        self._occupancy_sum = 0
+        self._occupancy_max = 0
+        self._error = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del exc_value, traceback
+        if exc_type is not None:
+            self.stop()
+        self.wait()
+
+    def start(self):
+        '''Acquires the stream-writing interface and starts the threads.'''
+        if self._threads:
+            raise RuntimeError('the player was already started')
+        if self._channel is not None:
+            self._inst.acquire_stream_intf(self._channel)
+        if self._packet_size is None:
+            self._packet_size = int(self._inst.get_stream_packet_size())
+        if self._packet_size <= 0:
+            raise ValueError(
+                'invalid stream packet size {0}'.format(self._packet_size))
+
+        self._ring = np.empty((self._ring_len, self._packet_size), dtype=np.uint8)
+        for idx in range(self._ring_len):
+            self._empty.put(idx)
+
+        self._threads = [
+            threading.Thread(target=self._produce, name='stream-producer', daemon=True),
+            threading.Thread(target=self._send, name='stream-sender', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        '''Stops the playback (the packets not pushed yet are dropped).'''
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        '''
+        Waits till all the blocks are pushed (or the playback stops).
+
+        :param timeout: maximal time to wait in seconds (None: no limit).
+        :returns: the statistics (see :meth:`stats`).
+        :raises RuntimeError: if the playback failed.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None
+                        else max(0.0, deadline - time.monotonic()))
+        stats = self.stats()
+        if self._error is not None:
+            raise RuntimeError('streaming failed: {0}'.format(self._error))
+        return stats
+
+    @property
+    def running(self):
+        '''True while the threads are running.'''
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        '''
+        Gets the statistics of the playback (can be called while playing).
+
+        :returns: dictionary with the keys `packets` and `bytes` (pushed),
+                  `elapsed` (seconds since the first push), `throughput`
+                  (bytes per second), `underruns` (times the sender found
+                  the ring empty, i.e. the producer was late) and
+                  `underrun_time` (seconds it waited), `stalls` (pushes
+                  that timed out, i.e. the instrument was not ready),
+                  `occupancy` (full packets in the ring now),
+                  `occupancy_mean` and `occupancy_max`, and `error`.
+        '''
+        with self._lock:
+            packets = self._packets
+            elapsed = 0.0
+            if self._t_start is not None:
+                elapsed = (self._t_end or time.monotonic()) - self._t_start
+            num_bytes = packets * (self._packet_size or 0)
+            return {
+                'packets': packets,
+                'bytes': num_bytes,
+                'elapsed': elapsed,
+                'throughput': num_bytes / elapsed if elapsed > 0 else 0.0,
+                'underruns': self._underruns,
+                'underrun_time': self._underrun_time,
+                'stalls': self._stalls,
+                'occupancy': self._full.qsize(),
+                'occupancy_mean': self._occupancy_sum / packets if packets else 0.0,
+                'occupancy_max': self._occupancy_max,
+                'error': self._error}
+
+    def _as_bytes(self, block):
+        '''Gets the raw bytes of a block (interleaving I/Q pairs).'''
+        if isinstance(block, (tuple, list)):
+            wave_i, wave_q = np.asarray(block[0]), np.asarray(block[1])
+            size = 2 * len(wave_i)
+            if self._iq_buff is None or len(self._iq_buff) < size or \
+                    self._iq_buff.dtype != wave_i.dtype:
+                self._iq_buff = np.empty(size, dtype=wave_i.dtype)
+            block = self._iq_buff[:size]
+            block[0::2] = wave_i
+            block[1::2] = wave_q
+        block = np.ascontiguousarray(block)
+        return block, block.reshape(-1).view(np.uint8)
+
+    def _pad_bytes(self, dtype, num_bytes):
+        '''Gets `num_bytes` bytes of the pad value.'''
+        pad_value = self._pad_value
+        if pad_value is None:
+            pad_value = np.iinfo(dtype).max // 2 if dtype.kind == 'u' else 0
+        count = -(-num_bytes // dtype.itemsize)
+        return np.full(count, pad_value, dtype=dtype).view(np.uint8)[:num_bytes]
+
+    def _take_empty(self):
+        '''Gets an empty buffer of the ring (waits for the sender), None if stopped.'''
+        while not self._stop.is_set():
+            try:
+                return self._empty.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _produce(self):
+        '''The producer thread: copies the blocks into packets.'''
+        size = self._packet_size
+        idx, fill, dtype = None, 0, None
+        try:
+            for block in self._blocks:
+                block, data = self._as_bytes(block)
+                dtype = block.dtype
+                pos = 0
+                while pos < len(data):
+                    if idx is None:
+                        idx, fill = self._take_empty(), 0
+                        if idx is None:
+                            return
+                    num = min(size - fill, len(data) - pos)
+                    self._ring[idx, fill:fill + num] = data[pos:pos + num]
+                    fill += num
+                    pos += num
+                    if fill == size:
+                        self._full.put(idx)
+                        idx = None
+            if idx is not None:
+                self._ring[idx, fill:] = self._pad_bytes(dtype, size - fill)
+                self._full.put(idx)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._error = 'producer: {0!r}'.format(ex)
+            self._stop.set()
+        finally:
+            self._full.put(None)
+
+    def _send(self):
+        '''The sender thread: pushes the full packets to the instrument.'''
+        if self._prefill:
+            while self._full.qsize() < self._ring_len and \
+                    self._producer_alive() and not self._stop.is_set():
+                time.sleep(0.001)
+
+        while not self._stop.is_set():
+            try:
+                idx = self._full.get_nowait()
+            except queue.Empty:
+                t_wait = time.monotonic()
+                idx = self._full.get()
+                if idx is not None and self._t_start is not None:
+                    with self._lock:
+                        self._underruns += 1
+                        self._underrun_time += time.monotonic() - t_wait
+            if idx is None:
+                break
+
+            occupancy = min(self._full.qsize() + 1, self._ring_len)
+            if self._t_start is None:
+                self._t_start = time.monotonic()
+            while not self._stop.is_set():
+                ret_code = self._inst.push_stream_packet(
+                    self._ring[idx], 0, self._usec_wait)
+                if ret_code == 0:
+                    break
+                if ret_code == 1:
+                    with self._lock:
+                        self._stalls += 1
+                    continue
+                self._error = 'push_stream_packet failed with error {0}'.format(
+                    ret_code)
+                self._stop.set()
+            else:
+                break
+            self._empty.put(idx)
+
+            with self._lock:
+                self._packets += 1
+                self._occupancy_sum += occupancy
+                self._occupancy_max = max(self._occupancy_max, occupancy)
+
+        with self._lock:
+            self._t_end = time.monotonic()
+
+    def _producer_alive(self):
+        return self._threads[0].is_alive()
@@ -82,16 +82,20 @@ import os
 import gc
 import numpy as np
 import ctypes as ct
+import string
 import warnings
 from ctypes.util import find_library
 from numpy.ctypeslib import ndpointer
+from tep_scpi_batch import ScpiBatch, ErrorLog, is_error_query
+from tep_binary import as_array, iter_chunks, trace_data_offset
 
 __version__ = '1.0.1'
 __docformat__ = 'reStructuredText'
 
 __all__ = [
     'TEProteusAdmin',
-    'TEProteusInst']
+    'TEProteusInst',
+    'ScpiTemplate']
 
 
 class TEProteusAdmin(object):
@@ -722,6 +726,12 @@ class TEProteusInst(object):
         self._streamptr = None
         self._instr_id = self._admin._tep_get_instrument_id(inst_ptr)
         self._default_paranoia_level = 1
+        self._scpi_batch = None
+        self._error_log = None
+        # response buffers reused by every call (not thread-safe)
+        self._resp_buf = ct.create_string_buffer(256)
+        self._cmd_resp_buf = ct.create_string_buffer(64)
+        self._copied_bytes = 0
 
     def __enter__(self):
         return self
@@ -754,6 +764,48 @@ class TEProteusInst(object):
         value = max(0, min(int(value), 2))
         self._default_paranoia_level = value
 
+    def batch(self, max_len=1024, check_errors=True):
+        '''Gets a context-manager that batches the SCPI commands.
+
+        Inside the `with` block :meth:`send_scpi_cmd` only queues the
+        commands; they are joined with `;` (up to `max_len` characters)
+        and sent as few bare commands, and `:SYST:ERR?` is checked once
+        at the end. Queries and binary transfers flush the queue first.
+
+        :param max_len: the maximal length of a joined SCPI string.
+        :param check_errors: should check `:SYST:ERR?` at the end?
+        :returns: a :class:`tep_scpi_batch.ScpiBatch` instance.
+        '''
+        return ScpiBatch(self, max_len, check_errors)
+
+    def defer_errors(self, enable=True, depth=256):
+        '''Turns on (or off) the deferred error-checking.
+
+        While it is on, :meth:`send_scpi_cmd` sends bare commands (unless
+        `paranoia_level` is given explicitly), the last `depth` commands
+        are remembered, and the error-queue is drained only at checkpoints:
+        :meth:`checkpoint` and every `:SYST:ERR?` query, where the errors
+        are attributed to the commands that most probably caused them.
+
+        :param enable: turn on (True) or off (False)?
+        :param depth: the number of commands to remember.
+        :returns: the :class:`tep_scpi_batch.ErrorLog` (`None` if off).
+        '''
+        self._error_log = ErrorLog(self, depth) if enable else None
+        return self._error_log
+
+    def checkpoint(self, label=''):
+        '''Drains the error-queue (e.g. after a task-table write or
+        before an acquisition) and warns about the errors found.
+
+        :param label: name of the checkpoint (for the warnings).
+        :returns: list of the errors (see :meth:`ErrorLog.checkpoint`).
+        '''
+        if self._error_log is None:
+            # no commands remembered, the errors are just drained
+            return ErrorLog(self).checkpoint(label)
+        return self._error_log.checkpoint(label)
+
     def close_instrument(self):
         '''Closes this instrument.'''
         if self._admin is not None:
@@ -775,22 +827,32 @@ class TEProteusInst(object):
         :param max_resp_len: the maximal length of the response string.
         :returns: response-string
         '''
-        scpi_str = str(scpi_str).encode()
-        str_ptr = ct.c_char_p(scpi_str)
-        max_resp_len = int(max_resp_len)
-        resp_buf = ct.create_string_buffer(max_resp_len)
-        max_resp_len = np.uint32(max_resp_len)
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
+        if self._error_log is not None and is_error_query(scpi_str):
+            return self._error_log.checkpoint_response()
+        return self._query_bytes(str(scpi_str).encode(), max_resp_len)
+
+    def _query_bytes(self, scpi_str, max_resp_len=256):
+        '''Sends (already encoded) SCPI query, reusing the response buffer.
+        :param scpi_str: the SCPI string (`bytes`).
+        :param max_resp_len: the maximal length of the response string.
+        :returns: response-string
+        '''
+        resp_buf = self._resp_buf
+        if max_resp_len > len(resp_buf):
+            resp_buf = self._resp_buf = ct.create_string_buffer(int(max_resp_len))
+        resp_buf[0] = b'\0'
 
         # pylint: disable=protected-access
         ret_code = self._admin._tep_send_scpi(
-            self._commptr, str_ptr, resp_buf, max_resp_len)
+            self._commptr, scpi_str, resp_buf, max_resp_len)
 
         if 0 != ret_code:
             wmsg = '\"{0}\" failed with error {1}'.format(scpi_str, ret_code)
             warnings.warn(wmsg)
 
-        resp_str = str(resp_buf.value, 'utf-8').strip()
-        return resp_str
+        return resp_buf.value.decode().strip()
 
     def send_scpi_cmd(self, scpi_str, paranoia_level=None):
         '''Sends SCPI query to instrument.
@@ -807,50 +869,115 @@ class TEProteusInst(object):
         :param paranoia_level: either 0, 1, 2 or None.
         :returns: error-code.
         '''
+        entry = None
+        if self._error_log is not None:
+            entry = self._error_log.record(scpi_str)
+            if paranoia_level is None:
+                paranoia_level = 0
+
+        if self._scpi_batch is not None:
+            return self._scpi_batch.add(scpi_str, entry)
+
         if paranoia_level is None:
             paranoia_level = self._default_paranoia_level
 
-        scpi_str = str(scpi_str).strip()
+        ret_code = self._send_cmd_bytes(
+            str(scpi_str).strip().encode(), paranoia_level)
+
+        if entry is not None:
+            entry[2] = ret_code
+
+        return ret_code
+
+    def _send_cmd_bytes(self, scpi_str, paranoia_level):
+        '''Sends (already encoded) SCPI command, reusing the response buffer.
+        :param scpi_str: the SCPI string (stripped `bytes`).
+        :param paranoia_level: either 0, 1 or 2.
+        :returns: error-code.
+        '''
         if 1 == paranoia_level:
             if scpi_str:
-                cmd = str(scpi_str + '; *OPC?').encode()
+                cmd = scpi_str + b'; *OPC?'
             else:
-                cmd = str('*OPC?').encode()
+                cmd = b'*OPC?'
         elif paranoia_level > 1:
             if scpi_str:
-                cmd = str(scpi_str + '; :SYST:ERR?').encode()
+                cmd = scpi_str + b'; :SYST:ERR?'
             else:
-                cmd = str(':SYST:ERR?').encode()
+                cmd = b':SYST:ERR?'
         else:
-            cmd = scpi_str.encode()
+            cmd = scpi_str
 
-        str_ptr = ct.c_char_p(cmd)
-        max_resp_len = int(64)
-        resp_buf = ct.create_string_buffer(max_resp_len)
-        max_resp_len = np.uint32(max_resp_len)
+        resp_buf = self._cmd_resp_buf
+        resp_buf[0] = b'\0'
 
         # pylint: disable=protected-access
         ret_code = self._admin._tep_send_scpi(
-            self._commptr, str_ptr, resp_buf, max_resp_len)
+            self._commptr, cmd, resp_buf, 64)
 
         if paranoia_level > 1:
-            resp_str = str(resp_buf.value, 'utf-8').strip()
+            resp_str = resp_buf.value.decode().strip()
             if not resp_str.startswith('0'):
-                wrnmsg = 'CMD: "{0}", SYST:ERR: {1}'.format(scpi_str, resp_str)
+                wrnmsg = 'CMD: "{0}", SYST:ERR: {1}'.format(
+                    scpi_str.decode(), resp_str)
                 warnings.warn(wrnmsg)
-                cmd = str('*CLS').encode()
-                str_ptr = ct.c_char_p(cmd)
                 self._admin._tep_send_scpi(
-                    self._commptr, str_ptr, resp_buf, max_resp_len)
+                    self._commptr, b'*CLS', resp_buf, 64)
 
         return ret_code
 
-    def write_binary_data(self, scpi_pref, bin_dat):
+    def scpi_template(self, fmt):
+        '''Gets a pre-encoded SCPI command (or query) with fields.
+
+        For commands sent over and over with different numbers, e.g.
+        `inst.scpi_template(':TASK:COMP:SEL {0}').send(5)`, or polled
+        queries, e.g. `inst.scpi_template(':DIG:ACQ:FRAM:STAT?').query()`.
+
+        :param fmt: the SCPI string, with `str.format` fields.
+        :returns: a :class:`ScpiTemplate` instance.
+        '''
+        return ScpiTemplate(self, fmt)
+
+    def write_binary_data(self, scpi_pref, bin_dat, chunk_bytes=2**20):
         '''Sends block of binary-data to instrument.
+
+        The data is sent straight from its memory if it is contiguous.
+        Non-contiguous data after a `:TRAC:DATA [<offset>,]` prefix is sent
+        in chunks (through a reused scratch buffer) at consecutive offsets;
+        after other prefixes it is copied once.
+
         :param scpi_pref: a SCPI string that defines the data (can be None).
-        :param bin_dat: a `numpy` array with the binary data.
+        :param bin_dat: the binary data: a `numpy` array (or `np.memmap`),
+                        or any buffer-protocol object (`memoryview`,
+                        `bytes`, `bytearray`).
+        :param chunk_bytes: the chunk size for non-contiguous data.
         :returns: zero if succeeded; otherwise, error code.
         '''
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
+
+        bin_dat, copied = as_array(bin_dat)
+        self._copied_bytes += copied
+
+        if not bin_dat.flags.c_contiguous:
+            offset = trace_data_offset(scpi_pref)
+            if offset is None:
+                bin_dat = np.ascontiguousarray(bin_dat)
+                self._copied_bytes += bin_dat.nbytes
+            else:
+                for chunk, copied in iter_chunks(bin_dat, chunk_bytes, align=64):
+                    self._copied_bytes += copied
+                    ret_code = self._write_binary_block(
+                        ':TRAC:DATA {0},'.format(offset), chunk)
+                    if ret_code:
+                        return ret_code
+                    offset += len(chunk)
+                return 0
+
+        return self._write_binary_block(scpi_pref, bin_dat)
+
+    def _write_binary_block(self, scpi_pref, bin_dat):
+        '''Sends contiguous `numpy` array (no copy).'''
         scpi_pref = str(scpi_pref).encode()
         str_ptr = ct.c_char_p(scpi_pref)
 
@@ -861,6 +988,17 @@ class TEProteusInst(object):
         return self._admin._tep_write_binary_data(
             self._commptr, str_ptr, p_dat, np.uint64(size_in_bytes))
 
+    def get_copied_bytes(self, reset=False):
+        '''Gets the number of bytes of binary-data that were copied in Python
+        (by `write_binary_data`, e.g. for non-contiguous arrays).
+        :param reset: reset the counter?
+        :returns: the number of bytes copied (since the last reset).
+        '''
+        copied = self._copied_bytes
+        if reset:
+            self._copied_bytes = 0
+        return copied
+
     def read_binary_data(self, scpi_pref, out_array, num_bytes):
         '''Reads block of binary-data from instrument.
         :param scpi_pref: a SCPI string that defines the data (can be None).
@@ -868,6 +1006,8 @@ class TEProteusInst(object):
         :param num_bytes: the data size in bytes.
         :returns: error-code (zero for success).
         '''
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
         scpi_pref = str(scpi_pref).encode()
         str_ptr = ct.c_char_p(scpi_pref)
 
@@ -971,3 +1111,247 @@ class TEProteusInst(object):
         # pylint: disable=protected-access
         return self._admin.\
             _tep_push_stream_packet(self._streamptr, p_dat, offs, tmo)
+
+
+class ScpiTemplate(object):
+    '''Pre-encoded SCPI command (or query) with fields.
+
+    The constant parts of the string (with the `*OPC?` suffix of
+    paranoia-level 1) are encoded once, integer fields are substituted
+    straight as bytes, and the DLL function is called directly with the
+    template's own buffers, so a call does no `str.format` and no `encode`.
+    Paranoia-level 2 goes through the instrument's command path (it has to
+    check the response), and when the instrument has an active batch or
+    error-log the template goes through :meth:`TEProteusInst.send_scpi_cmd`
+    (or `send_scpi_query`).
+    '''
+
+    def __init__(self, inst, fmt):
+        '''
+        Constructor.
+
+        User should normally call :meth:`TEProteusInst.scpi_template`.
+
+        :param inst: the :class:`TEProteusInst`.
+        :param fmt: the SCPI string, with `str.format` fields.
+        '''
+        self._inst = inst
+        self._fmt = str(fmt).strip()
+        self._literals = []
+        self._fields = []
+
+        auto_index = 0
+        for literal, field, spec, conv in string.Formatter().parse(self._fmt):
+            self._literals.append(literal.encode())
+            if field is None:
+                break
+            if field == '':
+                field = auto_index
+                auto_index += 1
+            if not str(field).isdigit() or conv:
+                raise ValueError(
+                    'only positional fields are supported: {0}'.format(fmt))
+            self._fields.append((int(field), spec))
+        else:
+            self._literals.append(b'')
+
+        if len(self._literals) == len(self._fields):
+            self._literals.append(b'')
+
+        # the command of every paranoia-level sent directly (0 and 1)
+        opc = b'; *OPC?' if self._literals[0] or len(self._literals) > 1 else b'*OPC?'
+        self._const = None
+        self._int_fmt = None
+        if not self._fields:
+            self._const = self._literals[0]
+            self._cmds = (self._const, self._const + opc)
+        elif all(field == (k, '') for k, field in enumerate(self._fields)):
+            # all-integer fields in order are substituted with a single `%`
+            self._int_fmt = b'%d'.join(
+                literal.replace(b'%', b'%%') for literal in self._literals)
+            self._cmds = (self._int_fmt, self._int_fmt + opc)
+
+        # pylint: disable=protected-access
+        self._send_scpi = inst._admin._tep_send_scpi
+        self._cmd_buf = ct.create_string_buffer(64)
+        self._resp_buf = ct.create_string_buffer(256)
+
+    def encode(self, *args):
+        '''Gets the SCPI string (`bytes`) with the given field values.'''
+        if self._const is not None:
+            return self._const
+
+        if self._int_fmt is not None:
+            for value in args:
+                if type(value) is not int:  # pylint: disable=unidiomatic-typecheck
+                    break
+            else:
+                return self._int_fmt % args
+
+        literals = self._literals
+        parts = [literals[0]]
+        for k, (index, spec) in enumerate(self._fields):
+            value = args[index]
+            if type(value) is int and not spec:  # pylint: disable=unidiomatic-typecheck
+                parts.append(b'%d' % value)
+            else:
+                parts.append(format(value, spec).encode())
+            parts.append(literals[k + 1])
+        return b''.join(parts)
+
+    def send(self, *args, paranoia_level=None):
+        '''Sends the command with the given field values.
+        :param paranoia_level: either 0, 1, 2 or None (see `send_scpi_cmd`).
+        :returns: error-code.
+        '''
+        inst = self._inst
+        # pylint: disable=protected-access
+        if inst._scpi_batch is not None or inst._error_log is not None:
+            return inst.send_scpi_cmd(
+                self.encode(*args).decode(), paranoia_level)
+        if paranoia_level is None:
+            paranoia_level = inst._default_paranoia_level
+        if paranoia_level > 1:
+            return inst._send_cmd_bytes(self.encode(*args), paranoia_level)
+
+        cmd = None
+        if self._const is not None:
+            cmd = self._cmds[paranoia_level]
+        elif self._int_fmt is not None:
+            for value in args:
+                if type(value) is not int:  # pylint: disable=unidiomatic-typecheck
+                    break
+            else:
+                cmd = self._cmds[paranoia_level] % args
+        if cmd is None:
+            cmd = self.encode(*args)
+            if paranoia_level:
+                cmd += b'; *OPC?'
+
+        resp_buf = self._cmd_buf
+        resp_buf[0] = b'\0'
+        return self._send_scpi(inst._commptr, cmd, resp_buf, 64)
+
+    def query(self, *args, max_resp_len=256):
+        '''Sends the query with the given field values.
+        :param max_resp_len: the maximal length of the response string.
+        :returns: response-string
+        '''
+        inst = self._inst
+        # pylint: disable=protected-access
+        if inst._scpi_batch is not None or inst._error_log is not None:
+            return inst.send_scpi_query(
+                self.encode(*args).decode(), max_resp_len)
+
+        scpi_str = self._const
+        if scpi_str is None:
+            scpi_str = self.encode(*args)
+
+        resp_buf = self._resp_buf
+        if max_resp_len > len(resp_buf):
+            resp_buf = self._resp_buf = ct.create_string_buffer(int(max_resp_len))
+        resp_buf[0] = b'\0'
+
+        ret_code = self._send_scpi(inst._commptr, scpi_str, resp_buf, max_resp_len)
+        if 0 != ret_code:
+            wmsg = '\"{0}\" failed with error {1}'.format(scpi_str, ret_code)
+            warnings.warn(wmsg)
+
+        return resp_buf.value.decode().strip()
+
+
+def benchmark_scpi_calls(num_calls=100000, rounds=5):
+    '''
+    Measures the calls per second of the SCPI methods of
+    :class:`TEProteusInst` against a stub of `tep_send_scpi`, so that only
+    the Python-side overhead is measured. The stub is a `ctypes` callback
+    with the DLL's signature (it answers nothing), called through a foreign
+    function pointer as the DLL function is. The callback itself costs
+    more than a C function, so the bare call of the stub is measured too,
+    and its time is subtracted from every kind (the `overhead` column).
+    The allocating implementation of the previous version is measured as
+    well, for comparison. The kinds are measured in turns, `rounds` times,
+    and the best round of each kind is taken.
+
+    :param num_calls: the number of calls of each kind (in every round).
+    :param rounds: the number of rounds.
+    :returns: dict of the calls per second of each kind
+              (`stub` is the bare call of the stub).
+    '''
+    import time
+
+    argtypes = [
+        ct.c_int64, ct.c_char_p, ct.POINTER(ct.c_char), ct.c_uint32]
+
+    proto = ct.CFUNCTYPE(ct.c_int, *argtypes)
+
+    @proto
+    def stub_send_scpi(commptr, scpi_str, resp_buf, max_resp_len):
+        del commptr, scpi_str, resp_buf, max_resp_len
+        return 0
+
+    # re-wrap the callback as a foreign function, as the DLL function is
+    send_scpi = ct.cast(stub_send_scpi, proto)
+
+    class StubAdmin(object):
+        '''Just enough of TEProteusAdmin for TEProteusInst.'''
+        _tep_send_scpi = staticmethod(send_scpi)
+
+        def _tep_open_comm_intf(self, inst_ptr):
+            return 0
+
+        def _tep_get_instrument_id(self, inst_ptr):
+            return 1
+
+    inst = TEProteusInst(StubAdmin(), 0, (1,))
+    inst.default_paranoia_level = 0
+
+    def legacy_query(scpi_str, max_resp_len=256):
+        scpi_str = str(scpi_str).encode()
+        str_ptr = ct.c_char_p(scpi_str)
+        max_resp_len = int(max_resp_len)
+        resp_buf = ct.create_string_buffer(max_resp_len)
+        max_resp_len = np.uint32(max_resp_len)
+        send_scpi(0, str_ptr, resp_buf, max_resp_len)
+        return str(resp_buf.value, 'utf-8').strip()
+
+    def legacy_cmd(scpi_str):
+        cmd = str(scpi_str).strip().encode()
+        str_ptr = ct.c_char_p(cmd)
+        resp_buf = ct.create_string_buffer(64)
+        send_scpi(0, str_ptr, resp_buf, np.uint32(64))
+
+    poll = inst.scpi_template(':DIG:ACQuire:FRAM:STAT?')
+    select = inst.scpi_template(':TASK:COMP:SEL {0}')
+
+    stub_buf = ct.create_string_buffer(256)
+
+    cases = [
+        ('stub', lambda i: send_scpi(0, b':DIG:ACQuire:FRAM:STAT?', stub_buf, 256)),
+        ('query (previous)', lambda i: legacy_query(':DIG:ACQuire:FRAM:STAT?')),
+        ('query', lambda i: inst.send_scpi_query(':DIG:ACQuire:FRAM:STAT?')),
+        ('query (template)', lambda i: poll.query()),
+        ('cmd (previous)', lambda i: legacy_cmd(':TASK:COMP:SEL {0}'.format(i))),
+        ('cmd', lambda i: inst.send_scpi_cmd(':TASK:COMP:SEL {0}'.format(i))),
+        ('cmd (template)', lambda i: select.send(i)),
+    ]
+
+    results = dict((name, 0.0) for name, _ in cases)
+    for _ in range(max(1, int(rounds))):
+        for name, func in cases:
+            start = time.perf_counter()
+            for i in range(num_calls):
+                func(i)
+            results[name] = max(
+                results[name], num_calls / (time.perf_counter() - start))
+
+    stub_time = 1.0 / results['stub']
+    for name, _ in cases:
+        print('{0:>18}: {1:12,.0f} calls/s, overhead {2:6.3f} usec/call'.format(
+            name, results[name], (1.0 / results[name] - stub_time) * 1e6))
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_scpi_calls()
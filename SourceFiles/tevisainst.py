@@ -59,6 +59,8 @@ import warnings
 import numpy as np
 import pyvisa as visa
 import pyvisa.constants as vc
+from tep_scpi_batch import ScpiBatch, ErrorLog, is_error_query
+from tep_binary import as_array, iter_chunks, ieee_header
 
 __version__ = '1.0.1'
 __docformat__ = 'reStructuredText'
@@ -84,6 +86,10 @@ class TEVisaInst(object):
         self._visa_resource_name = None
         self._default_paranoia_level = 1
         self._resource_manager = None
+        self._scpi_batch = None
+        self._error_log = None
+        self._copied_bytes = 0
+        self._raw_buffers_ok = None
         if address is not None:
             self.open_instrument(address, port)
 
@@ -123,6 +129,48 @@ class TEVisaInst(object):
         value = max(0, min(int(value), 2))
         self._default_paranoia_level = value
 
+    def batch(self, max_len=1024, check_errors=True):
+        '''Gets a context-manager that batches the SCPI commands.
+
+        Inside the `with` block :meth:`send_scpi_cmd` only queues the
+        commands; they are joined with `;` (up to `max_len` characters)
+        and sent as few bare commands, and `:SYST:ERR?` is checked once
+        at the end. Queries and binary transfers flush the queue first.
+
+        :param max_len: the maximal length of a joined SCPI string.
+        :param check_errors: should check `:SYST:ERR?` at the end?
+        :returns: a :class:`tep_scpi_batch.ScpiBatch` instance.
+        '''
+        return ScpiBatch(self, max_len, check_errors)
+
+    def defer_errors(self, enable=True, depth=256):
+        '''Turns on (or off) the deferred error-checking.
+
+        While it is on, :meth:`send_scpi_cmd` sends bare commands (unless
+        `paranoia_level` is given explicitly), the last `depth` commands
+        are remembered, and the error-queue is drained only at checkpoints:
+        :meth:`checkpoint` and every `:SYST:ERR?` query, where the errors
+        are attributed to the commands that most probably caused them.
+
+        :param enable: turn on (True) or off (False)?
+        :param depth: the number of commands to remember.
+        :returns: the :class:`tep_scpi_batch.ErrorLog` (`None` if off).
+        '''
+        self._error_log = ErrorLog(self, depth) if enable else None
+        return self._error_log
+
+    def checkpoint(self, label=''):
+        '''Drains the error-queue (e.g. after a task-table write or
+        before an acquisition) and warns about the errors found.
+
+        :param label: name of the checkpoint (for the warnings).
+        :returns: list of the errors (see :meth:`ErrorLog.checkpoint`).
+        '''
+        if self._error_log is None:
+            # no commands remembered, the errors are just drained
+            return ErrorLog(self).checkpoint(label)
+        return self._error_log.checkpoint(label)
+
     @property
     def using_ni_visa(self):
         '''Indicates whether `pyvisa` uses NI-VISA (or its own implementation).
@@ -206,6 +254,10 @@ class TEVisaInst(object):
         :returns: response-string
         '''
         del max_resp_len
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
+        if self._error_log is not None and is_error_query(scpi_str):
+            return self._error_log.checkpoint_response()
         return self._vi.query(scpi_str)
 
     def send_scpi_cmd(self, scpi_str, paranoia_level=None):
@@ -223,6 +275,15 @@ class TEVisaInst(object):
         :param paranoia_level: either 0, 1, 2 or None.
         :returns: error-code.
         '''
+        entry = None
+        if self._error_log is not None:
+            entry = self._error_log.record(scpi_str)
+            if paranoia_level is None:
+                paranoia_level = 0
+
+        if self._scpi_batch is not None:
+            return self._scpi_batch.add(scpi_str, entry)
+
         if paranoia_level is None:
             paranoia_level = self._default_paranoia_level
         else:
@@ -260,6 +321,9 @@ class TEVisaInst(object):
             cmd = str(scpi_str)
             self._vi.write(cmd)
 
+        if entry is not None:
+            entry[2] = ret_code
+
         return ret_code
 
     def write_binary_data(
@@ -268,27 +332,47 @@ class TEVisaInst(object):
             bin_dat,
             dtype=None,
             paranoia_level=None,
-            mstmo=30000):
+            mstmo=30000,
+            chunk_bytes=2**20):
         '''Sends block of binary-data to instrument.
+
+        The IEEE block header and the data are written separately, so the
+        data is sent straight from its memory (non-contiguous data is sent
+        in chunks through a reused scratch buffer).
+
         :param scpi_pref: a SCPI string that defines the data (can be None).
-        :param bin_dat: a `numpy` array with the binary data.
+        :param bin_dat: the binary data: a `numpy` array (or `np.memmap`),
+                        or any buffer-protocol object (`memoryview`,
+                        `bytes`, `bytearray`).
         :param dtype: the data-type of the elements (optional).
         :param paranoia_level: either 0, 1, 2 or None.
         :param mstmo: timeout in milliseconds (can be None).
+        :param chunk_bytes: the chunk size for non-contiguous data.
         :returns: zero if succeeded; otherwise, error code.
         '''
 
         ret_val = -1
 
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
+
         if paranoia_level is None:
-            paranoia_level = self._default_paranoia_level
+            # as in `send_scpi_cmd`: the error-log checks the errors later
+            paranoia_level = 0 if self._error_log is not None \
+                else self._default_paranoia_level
         else:
             paranoia_level = int(paranoia_level)
 
+        if paranoia_level >= 2 and self._scpi_batch is not None \
+                and self._error_log is None:
+            # the batch checks the error-queue when it ends
+            paranoia_level = 1
+
         if scpi_pref is None:
             scpi_pref = ''
         else:
             scpi_pref = str(scpi_pref).strip()
+        data_pref = scpi_pref
 
         if paranoia_level >= 1:
             if scpi_pref:
@@ -305,14 +389,8 @@ class TEVisaInst(object):
 
             try:
 
-                if dtype is None and isinstance(bin_dat, np.ndarray):
-                    dtype = bin_dat.dtype.char
-
-                if dtype is not None:
-                    self._vi.write_binary_values(
-                        scpi_pref, bin_dat, datatype=dtype)
-                else:
-                    self._vi.write_binary_values(scpi_pref, bin_dat)
+                self._write_ieee_block(
+                    scpi_pref, bin_dat, dtype, chunk_bytes)
 
                 if paranoia_level >= 1:
                     # read the response to the *OPC?
@@ -326,7 +404,13 @@ class TEVisaInst(object):
 
             ret_val = 0
 
-            if paranoia_level >= 2:
+            if paranoia_level >= 2 and self._error_log is not None:
+                # drain the error-queue through the error-log,
+                # so the errors are attributed to their commands
+                errors = self._error_log.checkpoint(data_pref or 'binary-data')
+                if errors:
+                    ret_val = errors[0]['code']
+            elif paranoia_level >= 2:
                 resp_str = self._vi.query(':SYST:ERR?')
                 resp_str = str(resp_str).strip()
 
@@ -343,6 +427,101 @@ class TEVisaInst(object):
 
         return ret_val
 
+    def _write_ieee_block(self, scpi_pref, bin_dat, dtype, chunk_bytes):
+        '''Writes the SCPI prefix, the IEEE block header, the data and the
+        write-termination as a single message (as `write_binary_values`).'''
+        if dtype is None and not isinstance(bin_dat, np.ndarray):
+            try:
+                memoryview(bin_dat)
+            except TypeError:
+                # sequence of values: float32, as in `write_binary_values`
+                dtype = 'f'
+
+        arr, copied = as_array(bin_dat, dtype)
+        self._copied_bytes += copied
+
+        termination = (self._vi.write_termination or '').encode()
+        total_bytes = arr.nbytes
+        sent_bytes = 0
+
+        # decided before anything is sent: once the header is on the bus
+        # there is no falling back
+        use_buffers = self._raw_buffers_supported()
+
+        orig_send_end = self._vi.send_end
+        header_sent = False
+        try:
+            self._vi.send_end = False
+            self._vi.write_raw(scpi_pref.encode() + ieee_header(total_bytes))
+            header_sent = True
+            for chunk, copied in iter_chunks(arr, chunk_bytes):
+                self._copied_bytes += copied
+                sent_bytes += chunk.nbytes
+                last = sent_bytes == total_bytes and not termination
+                self._write_raw_buffer(
+                    chunk.view(np.uint8), chunk_bytes, last, orig_send_end,
+                    use_buffers)
+            self._vi.send_end = orig_send_end
+            if termination:
+                self._vi.write_raw(termination)
+        except Exception:
+            if header_sent:
+                # the message was cut in the middle: resynchronize the session
+                try:
+                    self._vi.clear()
+                except Exception:  # pylint: disable=broad-except
+                    pass
+            raise
+        finally:
+            self._vi.send_end = orig_send_end
+
+    def _raw_buffers_supported(self):
+        '''Checks (once, without sending anything) if the VISA library
+        takes buffers (not only `bytes`) in `write_raw`.'''
+        if self._raw_buffers_ok is None:
+            visalib = self._vi.visalib
+            if type(visalib).__module__.startswith('pyvisa_py'):
+                # pyvisa-py passes the data to sockets / USB, which take buffers
+                supported = True
+            else:
+                # NI-VISA (ctypes): check the argument conversion of viWrite
+                try:
+                    visalib.lib.viWrite.argtypes[1].from_param(memoryview(b'\0'))
+                    supported = True
+                except (AttributeError, IndexError, TypeError,
+                        ctypes.ArgumentError):
+                    supported = False
+            self._raw_buffers_ok = supported
+        return self._raw_buffers_ok
+
+    def _write_raw_buffer(self, data, chunk_bytes, last, send_end, use_buffers):
+        '''Writes contiguous bytes (no copy if the VISA library takes buffers).'''
+        if use_buffers:
+            if last:
+                self._vi.send_end = send_end
+            self._vi.write_raw(memoryview(data))
+            return
+
+        # the VISA library takes only `bytes`: one chunk is copied at a time
+        chunk_bytes = max(1, int(chunk_bytes))
+        for pos in range(0, len(data), chunk_bytes):
+            block = data[pos:pos + chunk_bytes].tobytes()
+            self._copied_bytes += len(block)
+            if last and pos + chunk_bytes >= len(data):
+                self._vi.send_end = send_end
+            self._vi.write_raw(block)
+
+    def get_copied_bytes(self, reset=False):
+        '''Gets the number of bytes of binary-data that were copied in Python
+        (by `write_binary_data`, e.g. for non-contiguous arrays).
+        :param reset: reset the counter?
+        :returns: the number of bytes copied (since the last reset).
+        '''
+        copied = self._copied_bytes
+        if reset:
+            self._copied_bytes = 0
+        return copied
+
     def read_binary_data(
             self,
             scpi_pref,
@@ -358,6 +537,8 @@ class TEVisaInst(object):
 
         ret_val = -1
         del num_bytes
+        if self._scpi_batch is not None:
+            self._scpi_batch.flush()
         if self._vi is not None:
 
             if scpi_pref is None:
@@ -0,0 +1,254 @@
+"""This library contains lazy waveforms: the pulses, sums, concatenations etc. are only described here,
+and their datapoints are computed when they are needed (when downloaded with helpers.download_func),
+a chunk at a time, so the memory used is set by the chunk size and not by the length of the sequence."""
+
+import numpy as np
+
+
+CHUNK = 64 * 2**14  # default number of datapoints evaluated at a time (a multiple of 64, as the Proteus segments)
+
+
+class Waveform():
+    """
+    The base of all the lazy waveforms. A waveform knows its length in datapoints (len(wave)),
+    and can render the values of any range of its datapoints.
+
+    wave_1 + wave_2 gives their Sum and factor * wave gives a Scale of it.
+    """
+
+    seglen = 0
+
+    def __len__ (self):
+
+        return self.seglen
+
+    def __add__ (self, other):
+
+        return Sum(self, other)
+
+    def __mul__ (self, factor):
+
+        return Scale(self, factor)
+
+    __rmul__ = __mul__
+
+    def render (self, start = 0, stop = None, out = None):
+        """
+        Computes the values of the datapoints [start, stop) of the waveform.
+
+        INPUTS:
+            start - first datapoint
+            stop - end datapoint (not included), by default the end of the waveform
+            out - (optional) float array of length stop - start to write the values to
+
+        OUTPUTS:
+            The float array with the values
+        """
+
+        if stop is None:
+            stop = self.seglen
+
+        if out is None:
+            out = np.empty(stop - start)
+
+        self._render(start, stop, out)
+
+        return out
+
+    def chunks (self, chunk = CHUNK):
+        """
+        Goes through the whole waveform, chunk datapoints at a time. The same buffer is reused for all the chunks.
+
+        INPUTS:
+            chunk - how many datapoints to render at a time
+
+        OUTPUTS (yields):
+            offset - the first datapoint of the chunk
+            values - float array with the values of the chunk
+        """
+
+        buff = np.empty(min(chunk, self.seglen))
+
+        for start in range(0, self.seglen, chunk):
+            stop = min(start + chunk, self.seglen)
+            yield start, self.render(start, stop, buff[:stop - start])
+
+    def _render (self, start, stop, out):
+
+        raise NotImplementedError
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+class Samples(Waveform):
+    """An already computed array (of values between [-1 and 1]) as a waveform. The array is not copied."""
+
+    def __init__ (self, array):
+
+        self.array = np.asarray(array)
+        self.seglen = len(self.array)
+
+    def _render (self, start, stop, out):
+
+        out[:] = self.array[start:stop]
+
+
+class Generated(Waveform):
+    """A waveform given by a function of the datapoint indices, e.g. the envelope times carrier of a pulse."""
+
+    def __init__ (self, seglen, func):
+        """
+        INPUTS:
+            seglen - the length in datapoints
+            func - function that takes an array of (consecutive) datapoint indices and returns the values there
+        """
+
+        self.seglen = int(seglen)
+        self.func = func
+
+    def _render (self, start, stop, out):
+
+        out[:] = self.func(np.arange(start, stop))
+
+    @staticmethod
+    def pair (seglen, func):
+        """
+        Makes two waveforms (e.g. I and Q) out of one function that returns both of them at once.
+        When both are rendered over the same datapoints, the function is called only once.
+
+        INPUTS:
+            seglen - the length in datapoints
+            func - function that takes an array of datapoint indices and returns a pair of arrays (I, Q)
+
+        OUTPUTS:
+            The two waveforms
+        """
+
+        shared = _SharedChunk(func)
+
+        return Generated(seglen, lambda n: shared(n, 0)), Generated(seglen, lambda n: shared(n, 1))
+
+
+class _SharedChunk():
+    """Remembers the last chunk computed by a function that returns several components at once."""
+
+    def __init__ (self, func):
+
+        self.func = func
+        self._key = None
+        self._values = None
+
+    def __call__ (self, n, component):
+
+        key = (int(n[0]), len(n)) if len(n) else None
+
+        if key is None or key != self._key:
+            self._values = self.func(n)
+            self._key = key
+
+        return self._values[component]
+
+
+    #=============================================================#
+    #=============================================================#
+    #=============================================================#
+
+
+class Sum(Waveform):
+    """The sum of waveforms. The shorter ones count as zero after their end."""
+
+    def __init__ (self, *waves):
+
+        self.waves = waves
+        self.seglen = max(len(w) for w in waves)
+        self._scratch = np.empty(0)
+
+    def _render (self, start, stop, out):
+
+        if len(self._scratch) < stop - start:
+            self._scratch = np.empty(stop - start)
+
+        out[:] = 0.0
+
+        for w in self.waves:
+            a, b = start, min(stop, w.seglen)
+            if a < b:
+                part = self._scratch[:b - a]
+                w._render(a, b, part)
+                out[:b - a] += part
+
+
+class Concat(Waveform):
+    """The waveforms one after the other."""
+
+    def __init__ (self, *waves):
+
+        self.waves = waves
+        self.offsets = np.cumsum([0] + [len(w) for w in waves])
+        self.seglen = int(self.offsets[-1])
+
+    def _render (self, start, stop, out):
+
+        for w, offset in zip(self.waves, self.offsets):
+            a, b = max(start, offset), min(stop, offset + w.seglen)
+            if a < b:
+                w._render(a - offset, b - offset, out[a - start:b - start])
+
+
+class Scale(Waveform):
+    """A waveform multiplied by a factor."""
+
+    def __init__ (self, wave, factor):
+
+        self.wave = wave
+        self.factor = factor
+        self.seglen = wave.seglen
+
+    def _render (self, start, stop, out):
+
+        self.wave._render(start, stop, out)
+        out *= self.factor
+
+
+class Shift(Waveform):
+    """
+    A waveform delayed by a number of datapoints (advanced if negative), keeping its length.
+    The points shifted out are lost and the ones shifted in are zero.
+    """
+
+    def __init__ (self, wave, points):
+
+        self.wave = wave
+        self.points = int(points)
+        self.seglen = wave.seglen
+
+    def _render (self, start, stop, out):
+
+        out[:] = 0.0
+
+        a, b = max(start - self.points, 0), min(stop - self.points, self.wave.seglen)
+        if a < b:
+            self.wave._render(a, b, out[a + self.points - start:b + self.points - start])
+
+
+class Pad(Waveform):
+    """A waveform with a number of constant datapoints (by default zero) added before and after it."""
+
+    def __init__ (self, wave, before = 0, after = 0, value = 0.0):
+
+        self.wave = wave
+        self.before = int(before)
+        self.after = int(after)
+        self.value = value
+        self.seglen = self.before + wave.seglen + self.after
+
+    def _render (self, start, stop, out):
+
+        out[:] = self.value
+
+        a, b = max(start - self.before, 0), min(stop - self.before, self.wave.seglen)
+        if a < b:
+            self.wave._render(a, b, out[a + self.before - start:b + self.before - start])
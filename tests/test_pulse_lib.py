@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SourceFiles'))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pulse_lib
+
+
+def test_trapezoid_batch_with_aligned_widths ():
+    pulse = pulse_lib.Pulse(2e9, 1)
+
+    i, q, envelope = pulse.trapezoid_pulse_batch([0.5, 1.0], 1024/2e9, 2048/2e9, 1e8)
+
+    assert i.shape == q.shape == envelope.shape == (2, 2*1024 + 2048)
+    assert np.allclose(envelope[1], 2*envelope[0])
+
+
+def test_trapezoid_batch_with_unaligned_widths ():
+    pulse = pulse_lib.Pulse(2e9, 1)
+
+    i, q, envelope = pulse.trapezoid_pulse_batch([0.5, 1.0], 1000/2e9, 2000/2e9, 1e8)
+
+    assert i.shape[1] % 64 == 0
@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'SourceFiles'))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import tasks
+
+
+def _replay (segments, rows, first_segment = 1):
+    """Plays the task-table rows once (in order), without the delays."""
+    return np.concatenate([np.tile(segments[row.seg_num - first_segment], int(row.task_loops)) for row in rows])
+
+
+def test_long_blank_is_split_into_rows_of_at_most_max_loops ():
+    items = [np.zeros(100, dtype = np.uint16), 2048 * 2**21, np.zeros(100, dtype = np.uint16)]
+
+    segments, rows = tasks.pack_pulses(items)
+
+    assert all(1 <= row.task_loops <= tasks.MAX_TASK_LOOPS for row in rows)
+    assert sum(int(row.task_loops) for row in rows if row.task_loops > 1) > tasks.MAX_TASK_LOOPS
+    assert [row.next_task1 for row in rows] == list(range(2, len(rows) + 1)) + [1]
+
+    total = sum(int(row.task_loops) * len(segments[row.seg_num - 1]) for row in rows)
+    assert total == 64 * -(-(200 + 2048 * 2**21) // 64)
+
+
+def test_split_rows_replay_the_sequence ():
+    wave = np.full(2048 * 12, 7, dtype = np.uint16)
+    wave[:64] = 1
+    wave[-64:] = 2
+
+    saved = tasks.MAX_TASK_LOOPS
+    tasks.MAX_TASK_LOOPS = 3  # small enough to replay in memory
+    try:
+        segments, rows = tasks.compress_constant_runs(wave)
+    finally:
+        tasks.MAX_TASK_LOOPS = saved
+
+    assert all(row.task_loops <= 3 for row in rows)
+    assert len([row for row in rows if row.task_loops == 3]) >= 2
+    assert np.array_equal(_replay(segments, rows), wave)
+
+
+def test_same_pieces_share_one_segment ():
+    gate = np.arange(90, dtype = np.uint16)
+    items = [gate, 20390] * 50
+
+    segments, rows = tasks.pack_pulses(items)
+
+    assert len(segments) == 2